@@ -0,0 +1,39 @@
+"""audit events
+
+Revision ID: 3a9d1c7e5b20
+Revises: f7607d65421b
+Create Date: 2026-10-19 10:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3a9d1c7e5b20'
+down_revision = 'f7607d65421b'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('audit_events',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('entity_type', sa.String(length=50), nullable=False),
+    sa.Column('entity_id', sa.Integer(), nullable=True),
+    sa.Column('action', sa.String(length=50), nullable=False),
+    sa.Column('old_value', sa.String(length=100), nullable=True),
+    sa.Column('new_value', sa.String(length=100), nullable=True),
+    sa.Column('client', sa.String(length=100), nullable=True),
+    sa.Column('path', sa.String(length=200), nullable=True),
+    sa.Column('created_at', sa.DateTime(), nullable=False),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_audit_events_entity', 'audit_events', ['entity_type', 'entity_id', 'created_at'], unique=False)
+    op.create_index('ix_audit_events_created_at', 'audit_events', ['created_at'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_audit_events_created_at', table_name='audit_events')
+    op.drop_index('ix_audit_events_entity', table_name='audit_events')
+    op.drop_table('audit_events')
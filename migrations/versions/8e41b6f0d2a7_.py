@@ -0,0 +1,26 @@
+"""association table indexes
+
+Revision ID: 8e41b6f0d2a7
+Revises: 3a9d1c7e5b20
+Create Date: 2026-10-19 11:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8e41b6f0d2a7'
+down_revision = '3a9d1c7e5b20'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index('ix_personal_info_permits_permit_id', 'personal_info_permits', ['permit_id'], unique=False)
+    op.create_index('ix_permit_station_station_id', 'permit_station', ['station_id'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_permit_station_station_id', table_name='permit_station')
+    op.drop_index('ix_personal_info_permits_permit_id', table_name='personal_info_permits')
@@ -0,0 +1,30 @@
+"""jobs created_by
+
+Revision ID: b7d3e8a1f604
+Revises: 5c2f9a4e7d13
+Create Date: 2026-10-19 18:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b7d3e8a1f604'
+down_revision = '5c2f9a4e7d13'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('jobs', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('created_by', sa.Integer(), nullable=True))
+        batch_op.create_foreign_key('fk_jobs_created_by_users', 'users', ['created_by'], ['id'])
+        batch_op.create_index('ix_jobs_created_by', ['created_by'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('jobs', schema=None) as batch_op:
+        batch_op.drop_index('ix_jobs_created_by')
+        batch_op.drop_constraint('fk_jobs_created_by_users', type_='foreignkey')
+        batch_op.drop_column('created_by')
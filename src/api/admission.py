@@ -0,0 +1,241 @@
+"""
+Admission control for the api blueprint.
+
+Two checks run before every /api request:
+
+- a token bucket per client limits the request rate, RATE_LIMIT_RATE tokens
+  per second with bursts of up to RATE_LIMIT_BURST. Over the limit the request
+  gets a 429. The client is its X-Api-Key when the key is one of API_KEYS,
+  otherwise its address (request.remote_addr, resolved by ProxyFix in app.py),
+  so a client cannot get fresh buckets by sending made up headers. A batch is
+  charged one token per sub-request when it is admitted, its sub-requests do
+  not take tokens again.
+- a concurrency cap per endpoint class (ADMISSION_LIMITS) fails fast with a
+  503 when all the slots are busy, instead of queueing behind the database.
+
+Both responses carry a Retry-After header. Buckets live in process memory by
+default; set ADMISSION_STORE to a sqlite file path to share them between the
+gunicorn workers of a host. Buckets that have refilled completely are pruned
+from either store, since a missing bucket is the same as a full one.
+Concurrency caps are always per worker.
+"""
+import hashlib
+import logging
+import math
+import os
+import sqlite3
+import threading
+import time
+from collections import Counter
+from flask import current_app, jsonify, request
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_LIMITS = "gate=32,read=16,write=8,batch=4"
+
+
+PRUNE_INTERVAL = 60
+
+
+def admission_class(name, cost=None):
+    """
+    Put an endpoint in its own concurrency class, by default GET is 'read' and
+    the rest 'write'. cost is an optional function returning the number of
+    tokens the current request takes from the client's bucket (1 by default)
+    """
+    def decorator(view):
+        view.admission_class = name
+        if cost is not None:
+            view.admission_cost = cost
+        return view
+    return decorator
+
+
+class MemoryBucketStore:
+
+    def __init__(self, max_keys=100000):
+        self.max_keys = max_keys
+        self._buckets = {}
+        self._lock = threading.Lock()
+        self._pruned = 0
+
+    def _prune(self, rate, burst, now):
+        self._buckets = {key: (tokens, updated) for key, (tokens, updated) in self._buckets.items()
+                         if now - updated < (burst - tokens) / rate}
+        if len(self._buckets) >= self.max_keys:
+            # still full of active clients, keep the most recent half
+            recent = sorted(self._buckets.items(), key=lambda item: item[1][1])[len(self._buckets) // 2:]
+            self._buckets = dict(recent)
+        self._pruned = now
+
+    def take(self, key, rate, burst, now, cost=1):
+        """Take cost tokens, returns the seconds to wait until they are available or 0 when admitted"""
+        with self._lock:
+            if now - self._pruned > PRUNE_INTERVAL or len(self._buckets) >= self.max_keys:
+                self._prune(rate, burst, now)
+            tokens, updated = self._buckets.get(key, (burst, now))
+            tokens = min(burst, tokens + (now - updated) * rate)
+            if tokens >= cost:
+                self._buckets[key] = (tokens - cost, now)
+                return 0
+            self._buckets[key] = (tokens, now)
+            return (cost - tokens) / rate
+
+
+class SQLiteBucketStore:
+    """Buckets in a local sqlite file so every worker on the host sees the same limits"""
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        self._pruned = 0
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=1.0, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("CREATE TABLE IF NOT EXISTS buckets (key TEXT PRIMARY KEY, tokens REAL, updated REAL)")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def take(self, key, rate, burst, now, cost=1):
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            if now - self._pruned > PRUNE_INTERVAL:
+                # any bucket untouched for burst / rate seconds is full again
+                conn.execute("DELETE FROM buckets WHERE updated < ?", (now - burst / rate,))
+                self._pruned = now
+            row = conn.execute("SELECT tokens, updated FROM buckets WHERE key = ?", (key,)).fetchone()
+            tokens, updated = row if row else (burst, now)
+            tokens = min(burst, tokens + (now - updated) * rate)
+            wait = 0 if tokens >= cost else (cost - tokens) / rate
+            if tokens >= cost:
+                tokens -= cost
+            conn.execute("INSERT OR REPLACE INTO buckets (key, tokens, updated) VALUES (?, ?, ?)",
+                         (key, tokens, now))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return wait
+
+
+class AdmissionController:
+
+    def __init__(self, store, rate, burst, limits):
+        self.store = store
+        self.rate = rate
+        self.burst = burst
+        self.slots = {name: threading.BoundedSemaphore(limit) for name, limit in limits.items()}
+        self.stats = Counter()
+        self._stats_lock = threading.Lock()
+
+    def count(self, decision, endpoint_class):
+        with self._stats_lock:
+            self.stats[f"{endpoint_class}.{decision}"] += 1
+
+    def rate_limit(self, client, cost=1):
+        # a request can never take more than a full bucket
+        cost = min(cost, self.burst)
+        try:
+            return self.store.take(client, self.rate, self.burst, time.time(), cost)
+        except sqlite3.Error:
+            # a shared store that is locked or broken must not take the api down, admit the request
+            logger.exception("Rate limit store failed, admitting request")
+            return 0
+
+    def acquire(self, endpoint_class):
+        slot = self.slots.get(endpoint_class)
+        if slot is None:
+            return True
+        if slot.acquire(blocking=False):
+            # kept in the environ, g is shared with the sub-requests of a batch
+            request.environ['saet.admission_slot'] = slot
+            return True
+        return False
+
+
+def detach_slot():
+    """
+    Take the admission slot of the current request away from the teardown hook,
+    for work that outlives the request. The caller must release it
+    """
+    return request.environ.pop('saet.admission_slot', None)
+
+
+def parse_limits(value):
+    limits = {}
+    for part in value.split(','):
+        if part.strip():
+            name, _, limit = part.partition('=')
+            limits[name.strip()] = int(limit)
+    return limits
+
+
+def _client_key(api_keys):
+    api_key = request.headers.get('X-Api-Key')
+    if api_key and api_key in api_keys:
+        # the key is a secret, the stores only see a digest of it
+        return "key:" + hashlib.sha256(api_key.encode()).hexdigest()[:16]
+    return "ip:" + (request.remote_addr or '')
+
+
+def _endpoint_class(view):
+    default = 'read' if request.method in ('GET', 'HEAD') else 'write'
+    return getattr(view, 'admission_class', default)
+
+
+def _reject(status_code, message, retry_after):
+    response = jsonify({"message": message})
+    response.status_code = status_code
+    response.headers['Retry-After'] = str(max(1, math.ceil(retry_after)))
+    return response
+
+
+def setup_admission(app):
+    store_path = app.config.get('ADMISSION_STORE')
+    controller = AdmissionController(
+        store=SQLiteBucketStore(store_path) if store_path else MemoryBucketStore(),
+        rate=float(app.config.get('RATE_LIMIT_RATE', 10.0)),
+        burst=float(app.config.get('RATE_LIMIT_BURST', 20.0)),
+        limits=parse_limits(app.config.get('ADMISSION_LIMITS', DEFAULT_LIMITS)),
+    )
+    app.extensions['admission'] = controller
+    retry_after_busy = float(app.config.get('ADMISSION_RETRY_AFTER', 1.0))
+    api_keys = frozenset(app.config.get('API_KEYS') or ())
+    if app.config.get('BATCH_MAX_REQUESTS', 20) > controller.burst:
+        logger.warning("RATE_LIMIT_BURST (%s) is lower than BATCH_MAX_REQUESTS (%s), large batches only "
+                       "pay for a full bucket", controller.burst, app.config.get('BATCH_MAX_REQUESTS', 20))
+
+    @app.before_request
+    def admit():
+        if request.blueprint != 'api' or request.method == 'OPTIONS':
+            return None
+        view = current_app.view_functions.get(request.endpoint)
+        endpoint_class = _endpoint_class(view)
+        # batch sub-requests were paid for and run inside the slot of their batch
+        if request.environ.get('saet.batch_subrequest'):
+            controller.count('admitted', endpoint_class)
+            return None
+        client = _client_key(api_keys)
+        cost = getattr(view, 'admission_cost', None)
+        wait = controller.rate_limit(client, cost() if cost is not None else 1)
+        if wait:
+            controller.count('rate_limited', endpoint_class)
+            logger.info("Rate limited %s on %s", client, request.path)
+            return _reject(429, "Too many requests", wait)
+        if not controller.acquire(endpoint_class):
+            controller.count('overloaded', endpoint_class)
+            logger.info("No %s slot free for %s", endpoint_class, request.path)
+            return _reject(503, "Server busy, try again later", retry_after_busy)
+        controller.count('admitted', endpoint_class)
+        return None
+
+    @app.teardown_request
+    def release(exc):
+        slot = request.environ.pop('saet.admission_slot', None)
+        if slot is not None:
+            slot.release()
@@ -0,0 +1,239 @@
+"""
+Write-behind audit log.
+
+Permit status changes and PersonalInfo.is_allow flips are picked up from the
+session flush, held until the transaction commits and then pushed into a
+bounded in-process buffer. A background thread drains the buffer every
+AUDIT_FLUSH_INTERVAL seconds with one multi-row insert per batch, so requests
+never wait on the audit table.
+
+Endpoints marked with @audit_access also get every allowed/denied answer
+recorded, see GET /api/access.
+"""
+import atexit
+import logging
+import os
+import queue
+import threading
+from datetime import datetime
+from flask import request, has_request_context, has_app_context, current_app
+from sqlalchemy import event, inspect, select
+from api.models import db, AuditEvent, Permit, PersonalInfo
+
+logger = logging.getLogger(__name__)
+
+# (model, attribute) pairs that produce an audit event when they change
+AUDITED_ATTRIBUTES = [
+    (Permit, 'status'),
+    (PersonalInfo, 'is_allow'),
+]
+
+
+class AuditWriter:
+
+    def __init__(self, buffer_size=10000, flush_interval=1.0, batch_size=500, block_timeout=0.5):
+        self.buffer = queue.Queue(maxsize=buffer_size)
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.block_timeout = block_timeout
+        self.engine = None
+        self._thread = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self._stopping = threading.Event()
+
+    def init_engine(self, engine):
+        self.engine = engine
+
+    def _ensure_started(self):
+        # threads do not survive a fork, gunicorn workers start their own writer
+        if self._thread is not None and self._pid == os.getpid() and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is not None and self._pid == os.getpid() and self._thread.is_alive():
+                return
+            self._pid = os.getpid()
+            self._stopping.clear()
+            self._thread = threading.Thread(target=self._run, name="audit-writer", daemon=True)
+            self._thread.start()
+
+    def put(self, row):
+        self._ensure_started()
+        try:
+            self.buffer.put(row, timeout=self.block_timeout)
+        except queue.Full:
+            # backpressure: the writer is behind, degrade to a synchronous insert instead of losing the event
+            logger.warning("Audit buffer full, writing event synchronously")
+            try:
+                self._insert([row])
+            except Exception:
+                # runs inside after_commit, failing here would turn a committed request into a 500
+                logger.exception("Could not write audit event %s", row)
+
+    def _take_batch(self, timeout):
+        try:
+            batch = [self.buffer.get(timeout=timeout)]
+        except queue.Empty:
+            return []
+        while len(batch) < self.batch_size:
+            try:
+                batch.append(self.buffer.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _insert(self, rows):
+        with self.engine.begin() as conn:
+            conn.execute(AuditEvent.__table__.insert(), rows)
+
+    def _run(self):
+        while not self._stopping.is_set():
+            self.flush(timeout=self.flush_interval)
+
+    def flush(self, timeout=0):
+        batch = self._take_batch(timeout)
+        while batch:
+            try:
+                self._insert(batch)
+            except Exception:
+                logger.exception("Could not write %d audit events", len(batch))
+            batch = self._take_batch(0)
+
+    def shutdown(self, timeout=5.0):
+        """Stop the writer thread and drain whatever is left in the buffer"""
+        self._stopping.set()
+        if self._thread is not None and self._pid == os.getpid():
+            self._thread.join(timeout)
+        if self.engine is not None:
+            self.flush()
+
+
+writer = AuditWriter()
+
+
+def _client_info():
+    # remote_addr is only trusted after ProxyFix (see app.py), never the raw X-Forwarded-For header
+    if has_request_context():
+        # without the query string, it can carry personal data like a national_id
+        return request.remote_addr, request.path[:200]
+    return None, None
+
+
+def record(entity_type, entity_id, action, old_value=None, new_value=None):
+    """Queue an audit event, used directly for events that are not model changes"""
+    client, path = _client_info()
+    writer.put({
+        "entity_type": entity_type,
+        "entity_id": entity_id,
+        "action": action,
+        "old_value": None if old_value is None else str(old_value),
+        "new_value": None if new_value is None else str(new_value),
+        "client": client,
+        "path": path,
+        "created_at": datetime.utcnow(),
+    })
+
+
+def record_access(entity_type, entity_id, allowed):
+    """Record the result of an access check"""
+    record(entity_type, entity_id, 'access_check', new_value='allowed' if allowed else 'denied')
+
+
+def audit_access(entity_type):
+    """
+    Mark an endpoint as an access check. The after_request hook of setup_audit
+    records every 200 (allowed) and 403 (denied) answer of the endpoint, the
+    view stores the id of the checked entity with set_audit_entity()
+    """
+    def decorator(view):
+        view.audit_access = entity_type
+        return view
+    return decorator
+
+
+def set_audit_entity(entity_id):
+    # kept in the environ, g is shared with the sub-requests of a batch
+    request.environ['saet.audit_entity_id'] = entity_id
+
+
+def _collect_changes(session, flush_context):
+    # after_flush still sees the attribute history and new objects already have their id
+    if has_app_context() and not current_app.config.get('AUDIT_ENABLED'):
+        return
+    pending = session.info.setdefault('audit_pending', [])
+    # the innermost transaction, so a rolled back savepoint only drops its own changes
+    transaction = session.get_nested_transaction() or session.get_transaction()
+    for obj in list(session.new) + list(session.dirty):
+        for model, attribute in AUDITED_ATTRIBUTES:
+            if not isinstance(obj, model):
+                continue
+            history = inspect(obj).attrs[attribute].history
+            if not history.has_changes():
+                continue
+            old_value = history.deleted[0] if history.deleted else None
+            new_value = history.added[0] if history.added else None
+            pending.append((transaction, (model.__name__, obj.id, f'{attribute}_change', old_value, new_value)))
+
+
+def _publish_changes(session):
+    pending = session.info.pop('audit_pending', None)
+    for transaction, (entity_type, entity_id, action, old_value, new_value) in pending or ():
+        record(entity_type, entity_id, action, old_value, new_value)
+
+
+def _within(transaction, ancestor):
+    while transaction is not None:
+        if transaction is ancestor:
+            return True
+        transaction = transaction.parent
+    return False
+
+
+def _discard_changes(session, previous_transaction):
+    if previous_transaction.parent is None:
+        session.info.pop('audit_pending', None)
+        return
+    # a savepoint: only the changes flushed inside it (or inside its own savepoints) are gone
+    pending = session.info.get('audit_pending')
+    if pending:
+        session.info['audit_pending'] = [entry for entry in pending
+                                         if not _within(entry[0], previous_transaction)]
+
+
+def query_events(entity_type=None, entity_id=None, since=None, until=None, limit=100):
+    """Read audit events, uses the (entity_type, entity_id, created_at) index"""
+    stmt = select(AuditEvent)
+    if entity_type is not None:
+        stmt = stmt.where(AuditEvent.entity_type == entity_type)
+    if entity_id is not None:
+        stmt = stmt.where(AuditEvent.entity_id == entity_id)
+    if since is not None:
+        stmt = stmt.where(AuditEvent.created_at >= since)
+    if until is not None:
+        stmt = stmt.where(AuditEvent.created_at < until)
+    stmt = stmt.order_by(AuditEvent.created_at.desc()).limit(limit)
+    return db.session.scalars(stmt).all()
+
+
+def setup_audit(app):
+    app.config.setdefault('AUDIT_ENABLED', True)
+    writer.flush_interval = float(app.config.get('AUDIT_FLUSH_INTERVAL', 1.0))
+    writer.batch_size = int(app.config.get('AUDIT_BATCH_SIZE', 500))
+    writer.block_timeout = float(app.config.get('AUDIT_BLOCK_TIMEOUT', 0.5))
+    writer.buffer = queue.Queue(maxsize=int(app.config.get('AUDIT_BUFFER_SIZE', 10000)))
+    with app.app_context():
+        writer.init_engine(db.engine)
+
+    event.listen(db.session, 'after_flush', _collect_changes)
+    event.listen(db.session, 'after_commit', _publish_changes)
+    event.listen(db.session, 'after_soft_rollback', _discard_changes)
+
+    @app.after_request
+    def audit_access_checks(response):
+        view = app.view_functions.get(request.endpoint)
+        entity_type = getattr(view, 'audit_access', None)
+        if entity_type is not None and response.status_code in (200, 403):
+            record_access(entity_type, request.environ.get('saet.audit_entity_id'), response.status_code == 200)
+        return response
+
+    atexit.register(writer.shutdown)
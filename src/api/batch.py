@@ -0,0 +1,153 @@
+"""
+In-process execution of batched sub-requests for POST /api/batch.
+
+Each sub-request is dispatched through the app like a normal request, without
+going back over the network, and gets its own status code. Sub-requests run
+inside the batch request's app context, so they share its db.session and the
+single pooled connection behind it. This is the default.
+
+When every sub-request is a read and BATCH_MAX_WORKERS > 1 they run
+concurrently on a thread pool instead; a session is not thread safe, so each
+worker then uses its own app context, session and pooled connection, and the
+pool is sized for them in app.py. Sub-requests still running when the batch
+times out are not interrupted, so the batch's admission slot is only released
+once the last of them finishes.
+"""
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+from flask import current_app, request
+from api.models import db
+from api.admission import detach_slot
+from api.utils import APIException
+
+logger = logging.getLogger(__name__)
+
+READ_METHODS = {'GET', 'HEAD'}
+# headers of the batch request that every sub-request inherits
+# the client address is passed as REMOTE_ADDR, already resolved by ProxyFix
+FORWARDED_HEADERS = ['Authorization', 'X-Api-Key', 'Accept-Language']
+
+_executor = {}
+
+
+def _get_executor(max_workers):
+    if max_workers not in _executor:
+        _executor[max_workers] = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="batch")
+    return _executor[max_workers]
+
+
+def batch_cost():
+    """Tokens a batch takes from the client's rate limit bucket, one per sub-request"""
+    payload = request.get_json(silent=True)
+    items = payload.get('requests') if isinstance(payload, dict) else None
+    return len(items) if isinstance(items, list) and items else 1
+
+
+def parse_batch(payload, max_requests):
+    items = payload.get('requests') if isinstance(payload, dict) else None
+    if not isinstance(items, list) or not items:
+        raise APIException("Expected a non empty 'requests' array", status_code=400)
+    if len(items) > max_requests:
+        raise APIException(f"A batch can have at most {max_requests} requests", status_code=400)
+    errors = {}
+    for index, item in enumerate(items):
+        if not isinstance(item, dict) or not isinstance(item.get('path'), str):
+            errors[index] = "must be an object with a 'path'"
+        elif not item['path'].startswith('/api/') or item['path'].split('?')[0].rstrip('/') == '/api/batch':
+            errors[index] = "path must be an /api/ endpoint other than /api/batch"
+        else:
+            item['method'] = str(item.get('method', 'GET')).upper()
+    if errors:
+        raise APIException("Invalid batch", status_code=400, payload={"errors": errors})
+    return items
+
+
+def _dispatch(app, item, headers, environ_base):
+    kwargs = {}
+    if item.get('body') is not None:
+        kwargs['json'] = item['body']
+    with app.test_request_context(item['path'], method=item['method'], headers=headers,
+                                  environ_base=environ_base, **kwargs):
+        # only endpoints of the api blueprint, /api/<unknown> would otherwise fall through to the static files
+        if request.blueprint != 'api' and request.routing_exception is None:
+            return {"status": 404, "body": {"message": "Not found"}}
+        try:
+            response = app.full_dispatch_request()
+        except Exception:
+            logger.exception("Batch sub-request %s %s failed", item['method'], item['path'])
+            db.session.rollback()
+            return {"status": 500, "body": {"message": "Internal server error"}}
+        response.direct_passthrough = False
+        body = response.get_json(silent=True)
+        if body is None:
+            body = response.get_data(as_text=True)
+        response.close()
+        return {"status": response.status_code, "body": body}
+
+
+def _not_run():
+    return {"status": 504, "body": {"message": "Batch time limit reached before this request finished"}}
+
+
+def _dispatch_in_context(app, item, headers, environ_base, deadline):
+    # a queued sub-request that only starts after the deadline would run for nobody
+    if time.monotonic() >= deadline:
+        return _not_run()
+    with app.app_context():
+        return _dispatch(app, item, headers, environ_base)
+
+
+def _release_slot_after(futures):
+    """Keep the batch's admission slot taken until the sub-requests that outlived it finish"""
+    slot = detach_slot()
+    if slot is None:
+        return
+    remaining = [len(futures)]
+    lock = threading.Lock()
+
+    def done(future):
+        with lock:
+            remaining[0] -= 1
+            last = remaining[0] == 0
+        if last:
+            slot.release()
+    for future in futures:
+        future.add_done_callback(done)
+
+
+def run_batch(items):
+    app = current_app._get_current_object()
+    timeout = app.config.get('BATCH_TIMEOUT', 10.0)
+    max_workers = app.config.get('BATCH_MAX_WORKERS', 1)
+    deadline = time.monotonic() + timeout
+    headers = {name: request.headers[name] for name in FORWARDED_HEADERS if name in request.headers}
+    environ_base = {'REMOTE_ADDR': request.remote_addr, 'saet.batch_subrequest': True}
+
+    if max_workers > 1 and len(items) > 1 and all(item['method'] in READ_METHODS for item in items):
+        executor = _get_executor(max_workers)
+        futures = [executor.submit(_dispatch_in_context, app, item, headers, environ_base, deadline)
+                   for item in items]
+        wait(futures, timeout=max(deadline - time.monotonic(), 0))
+        results = []
+        running = []
+        for future in futures:
+            if future.done():
+                results.append(future.result())
+                continue
+            if not future.cancel():
+                running.append(future)
+            results.append(_not_run())
+        if running:
+            _release_slot_after(running)
+        return results
+
+    # writes, or a single worker: run in order on the batch request's own session
+    results = []
+    for item in items:
+        if time.monotonic() >= deadline:
+            results.append(_not_run())
+            continue
+        results.append(_dispatch(app, item, headers, environ_base))
+    return results
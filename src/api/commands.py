@@ -31,4 +31,165 @@ def setup_commands(app):
 
     @app.cli.command("insert-test-data")
     def insert_test_data():
-        pass
\ No newline at end of file
+        pass
+
+    @app.cli.command("bench-schemas")
+    @click.argument("count", default=10000)
+    def bench_schemas(count):
+        """Measure the per item cost of validating a batch of payloads"""
+        import time
+        from api.schemas import validate_many
+        samples = {
+            "Permit": {"control_number": "P-000001", "type": "hot work", "status": "pending",
+                       "start_date": "2026-01-01T08:00:00", "end_date": "2026-01-02T08:00:00",
+                       "requester_id": 1, "approver_id": None, "stations": [1, 2, 3], "people": [4, 5]},
+            "PersonalInfo": {"full_name": "Test Person", "national_id": "1234567", "is_allow": True},
+            "Contractor": {"company_name": "ACME", "contact_email": "acme@test.com",
+                           "contact_phone": "555-0100", "personal_info_id": 1},
+            "Station": {"name": "Station 1", "coordenates": "10.0,-66.0", "address": "Main road",
+                        "region_id": 1, "market_id": 1},
+        }
+        for name, sample in samples.items():
+            items = [dict(sample) for x in range(int(count))]
+            start = time.perf_counter()
+            validate_many(name, items)
+            elapsed = time.perf_counter() - start
+            print(f"{name:<14} {count} items  {elapsed * 1000:8.2f} ms  {elapsed / int(count) * 1e6:6.2f} us/item")
+
+    @app.cli.command("check-queries")
+    @click.option("--update", is_flag=True, help="Store the current counts and plans as the new budgets")
+    def check_queries(update):
+        """Fail when a key query or endpoint sends more statements or scans an indexed table"""
+        from api import querycheck
+        budgets = querycheck.load_budgets()
+        failures = []
+        for dialect, url in querycheck.database_targets().items():
+            if not update and dialect not in budgets:
+                print(f"Skipping {dialect}, no budget recorded yet: run with --update against a scratch database")
+                continue
+            print(f"Checking {dialect}")
+            report = querycheck.run_checks(url)
+            for name, count in report["counts"].items():
+                print(f"  {name:<20} {count} queries")
+            if update:
+                budgets[dialect] = {"counts": report["counts"], "plans": report["plans"]}
+            else:
+                failures += [f"[{dialect}] {f}" for f in querycheck.compare(report, budgets.get(dialect, {}))]
+        if update:
+            querycheck.save_budgets(budgets)
+            print("Budgets updated in", querycheck.BUDGETS_FILE)
+        for failure in failures:
+            print("FAIL", failure)
+        if failures:
+            raise SystemExit(1)
+
+    @app.cli.command("bench-responses")
+    @click.argument("count", default=2000)
+    def bench_responses(count):
+        """Compare bytes and CPU per response for each JSON encoder and compression"""
+        import json
+        import os
+        import tempfile
+        import time
+        from api import querycheck, compression, json_provider
+
+        def measure(fn, repeat=5):
+            start = time.process_time()
+            for x in range(repeat):
+                result = fn()
+            return result, (time.process_time() - start) / repeat * 1000
+
+        url = "sqlite:///" + os.path.join(tempfile.gettempdir(), "bench_responses.db")
+        scratch = querycheck.make_scratch_app(url)
+        with scratch.app_context():
+            db.drop_all()
+            db.create_all()
+            querycheck.seed(db.session, permits=int(count))
+            payload = [p.serialize() for p in querycheck.list_permits(db.session, limit=None)]
+            db.session.remove()
+            db.drop_all()
+
+        encoders = {"stdlib json": lambda: json.dumps(payload, default=json_provider._default,
+                                                      separators=(",", ":")).encode()}
+        if json_provider.orjson is not None:
+            encoders["orjson"] = lambda: json_provider.orjson.dumps(payload, default=json_provider._default)
+        print(f"{count} permits")
+        for name, encode in encoders.items():
+            body, cpu = measure(encode)
+            print(f"  encode {name:<12} {len(body):>10} bytes  {cpu:8.2f} ms cpu")
+
+        encodings = ["gzip"] + (["br"] if compression.brotli is not None else [])
+        for encoding in encodings:
+            compressed, cpu = measure(lambda: compression.compress(body, encoding, app.config))
+            print(f"  {encoding:<19} {len(compressed):>10} bytes  {cpu:8.2f} ms cpu"
+                  f"  ({len(compressed) / len(body):.1%} of the original)")
+
+    @app.cli.command("bench-load")
+    @click.argument("url")
+    @click.option("--requests", "total", default=2000, help="Number of requests to send")
+    @click.option("--concurrency", default=32, help="Requests in flight at the same time")
+    def bench_load(url, total, concurrency):
+        """Send GET requests to a running server and report the throughput and latency"""
+        import time
+        import urllib.error
+        import urllib.request
+        from concurrent.futures import ThreadPoolExecutor
+
+        def fetch(x):
+            start = time.perf_counter()
+            try:
+                with urllib.request.urlopen(url, timeout=30) as response:
+                    response.read()
+                    status = response.status
+            except urllib.error.HTTPError as e:
+                status = e.code
+            except OSError:
+                status = 0
+            return status, time.perf_counter() - start
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            results = list(executor.map(fetch, range(total)))
+        elapsed = time.perf_counter() - start
+
+        latencies = sorted(latency for status, latency in results)
+        statuses = {}
+        for status, latency in results:
+            statuses[status] = statuses.get(status, 0) + 1
+        print(f"{total} requests, concurrency {concurrency}, {elapsed:.2f} s")
+        print(f"  throughput  {total / elapsed:8.1f} req/s")
+        print(f"  latency p50 {latencies[len(latencies) // 2] * 1000:8.1f} ms")
+        print(f"  latency p99 {latencies[int(len(latencies) * 0.99)] * 1000:8.1f} ms")
+        print(f"  statuses    {statuses}")
+
+    @app.cli.command("create-token")
+    @click.argument("email")
+    @click.option("--kind", "kinds", multiple=True, help="Job kind the token may queue, repeat for several")
+    @click.option("--audit", is_flag=True, help="The token may read GET /api/audit")
+    @click.option("--expires-hours", default=None, type=float, help="Lifetime, defaults to JWT_EXPIRES_HOURS")
+    def create_token(email, kinds, audit, expires_hours):
+        """Print a bearer token for the /api/jobs and /api/audit endpoints on behalf of a user"""
+        from datetime import timedelta
+        from flask_jwt_extended import create_access_token
+        from api.jobs import HANDLERS
+        if not app.config.get('JWT_SECRET_KEY'):
+            raise click.ClickException("Set a JWT_SECRET_KEY of at least 32 bytes first")
+        user = db.session.scalar(db.select(User).where(User.email == email))
+        if user is None:
+            raise click.ClickException(f"No user with email {email}")
+        unknown = [kind for kind in kinds if kind not in HANDLERS]
+        if unknown:
+            raise click.ClickException(f"Unknown job kind(s): {', '.join(unknown)}. Known: {', '.join(sorted(HANDLERS))}")
+        expires = timedelta(hours=expires_hours) if expires_hours is not None else None
+        print(create_access_token(identity=str(user.id), additional_claims={"job_kinds": list(kinds), "audit": audit},
+                                  expires_delta=expires))
+
+    @app.cli.command("worker")
+    @click.option("--processes", default=1, help="Worker processes, each one runs its own thread pool")
+    @click.option("--threads", default=4, help="Threads per process")
+    @click.option("--poll-interval", default=1.0, help="Seconds between polls when the queue is empty")
+    def worker(processes, threads, poll_interval):
+        """Run the background jobs queued in the jobs table"""
+        from api.jobs import run_worker, HANDLERS
+        print(f"Starting {processes} process(es) x {threads} thread(s) for: {', '.join(sorted(HANDLERS))}")
+        run_worker(app, processes=processes, threads=threads, poll_interval=poll_interval)
@@ -0,0 +1,173 @@
+"""
+Response compression.
+
+Compressible responses at least COMPRESS_MIN_SIZE bytes long are encoded with
+brotli (when the brotli package is installed and the client accepts it) or
+gzip, negotiated from the Accept-Encoding header of each request. Streamed
+responses are compressed chunk by chunk; generators are also flushed after
+every chunk, so the client still receives data as it is produced, while files
+(send_file) are only flushed at the end to keep the compression ratio.
+
+A compressed response gets a weak ETag with the encoding appended
+(W/"etag-gzip"). The suffix is removed from If-None-Match before the view runs,
+so send_file's conditional handling still answers 304.
+"""
+import re
+import zlib
+from flask import request
+
+try:
+    import brotli
+except ImportError:  # optional dependency
+    brotli = None
+
+COMPRESSIBLE_MIMETYPES = {
+    'application/json',
+    'application/javascript',
+    'text/html',
+    'text/css',
+    'text/plain',
+    'text/javascript',
+    'image/svg+xml',
+}
+
+
+class _Gzip:
+
+    def __init__(self, level):
+        # wbits 31 writes a gzip header instead of a raw zlib stream
+        self._compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+
+    def compress(self, data):
+        return self._compressor.compress(data)
+
+    def flush(self):
+        return self._compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self):
+        return self._compressor.flush(zlib.Z_FINISH)
+
+
+class _Brotli:
+
+    def __init__(self, quality):
+        self._compressor = brotli.Compressor(quality=quality)
+
+    def compress(self, data):
+        return self._compressor.process(data)
+
+    def flush(self):
+        return self._compressor.flush()
+
+    def finish(self):
+        return self._compressor.finish()
+
+
+def choose_encoding(accept_encodings):
+    if brotli is not None and accept_encodings.quality('br') > 0:
+        return 'br'
+    if accept_encodings.quality('gzip') > 0:
+        return 'gzip'
+    return None
+
+
+def make_compressor(encoding, config):
+    if encoding == 'br':
+        return _Brotli(config.get('COMPRESS_BR_LEVEL', 4))
+    return _Gzip(config.get('COMPRESS_LEVEL', 6))
+
+
+def compress(data, encoding, config):
+    compressor = make_compressor(encoding, config)
+    return compressor.compress(data) + compressor.finish()
+
+
+def _compress_stream(chunks, compressor, flush_chunks):
+    try:
+        for chunk in chunks:
+            if isinstance(chunk, str):
+                chunk = chunk.encode()
+            data = compressor.compress(chunk)
+            if flush_chunks:
+                data += compressor.flush()
+            if data:
+                yield data
+        yield compressor.finish()
+    finally:
+        if hasattr(chunks, 'close'):
+            chunks.close()
+
+
+def _should_compress(response):
+    if response.status_code != 200 or request.method == 'HEAD':
+        return False
+    if 'Content-Encoding' in response.headers or 'Range' in request.headers:
+        return False
+    return response.mimetype in COMPRESSIBLE_MIMETYPES
+
+
+_ENCODED_ETAG = re.compile(r'-(gzip|br)"')
+
+
+def _strip_etag_encoding():
+    """
+    Remove the encoding suffix from If-None-Match when it is the encoding this
+    request negotiates, a client that cached another encoding gets a full response
+    """
+    header = request.environ.get('HTTP_IF_NONE_MATCH')
+    if not header:
+        return
+    match = _ENCODED_ETAG.search(header)
+    if match is None or match.group(1) != choose_encoding(request.accept_encodings):
+        return
+    request.environ['HTTP_IF_NONE_MATCH'] = _ENCODED_ETAG.sub('"', header)
+    request.environ['saet.etag_encoding'] = match.group(1)
+    # if_none_match is a cached property, drop a value parsed before this hook
+    request.__dict__.pop('if_none_match', None)
+
+
+def _encoded_etag(response, encoding):
+    etag = response.get_etag()[0]
+    if etag:
+        # a compressed body is a different representation of the resource
+        response.set_etag(etag + '-' + encoding, weak=True)
+
+
+def setup_compression(app):
+    app.config.setdefault('COMPRESS_MIN_SIZE', 1024)
+
+    app.before_request(_strip_etag_encoding)
+
+    @app.after_request
+    def compress_response(response):
+        if response.status_code == 304:
+            # the client revalidated the compressed representation, answer with its ETag
+            encoding = request.environ.get('saet.etag_encoding')
+            response.vary.add('Accept-Encoding')
+            if encoding is not None:
+                _encoded_etag(response, encoding)
+            return response
+        if not _should_compress(response):
+            return response
+        response.vary.add('Accept-Encoding')
+        encoding = choose_encoding(request.accept_encodings)
+        if encoding is None:
+            return response
+
+        if response.is_streamed:
+            # file responses and generators, the final size is unknown so there is no threshold.
+            # send_file sets direct_passthrough, its chunks do not need to reach the client one by one
+            flush_chunks = not response.direct_passthrough
+            response.direct_passthrough = False
+            response.response = _compress_stream(response.response, make_compressor(encoding, app.config),
+                                                 flush_chunks)
+            response.headers.pop('Content-Length', None)
+        else:
+            data = response.get_data()
+            if len(data) < app.config['COMPRESS_MIN_SIZE']:
+                return response
+            response.set_data(compress(data, encoding, app.config))
+
+        response.headers['Content-Encoding'] = encoding
+        _encoded_etag(response, encoding)
+        return response
@@ -0,0 +1,267 @@
+"""
+Database backed job queue.
+
+The web tier only inserts a row in the jobs table and answers 202, the work is
+done by `flask worker`, which runs outside gunicorn and is not bound by its
+timeout:
+
+    $ flask worker --processes 2 --threads 4
+
+Workers claim jobs with SELECT ... FOR UPDATE SKIP LOCKED on Postgres, so two
+workers never pick the same row and never wait on each other. SQLite has no
+row locks but serializes writers, there a compare-and-set UPDATE on the status
+does the same job. A failed job is queued again with exponential backoff until
+it reaches max_attempts. While a handler runs, a heartbeat thread refreshes
+locked_at, so only jobs whose worker died are taken back by requeue_stale,
+however long they run. Handlers are registered with @job_handler, see
+api/tasks.py.
+
+The /api/jobs endpoints need a bearer token, which lists the job kinds it may
+queue and only sees its own jobs:
+
+    $ flask create-token someone@example.com --kind personal_info.import --kind permits.report
+"""
+import logging
+import multiprocessing
+import os
+import signal
+import socket
+import threading
+import traceback
+from datetime import datetime, timedelta
+from sqlalchemy import select, update
+from api.models import db, Job
+from api.utils import APIException
+
+logger = logging.getLogger(__name__)
+
+HANDLERS = {}
+
+
+class PermanentJobError(Exception):
+    """Raised by a handler when retrying cannot help, the job fails right away"""
+
+
+def job_handler(kind):
+    def decorator(fn):
+        HANDLERS[kind] = fn
+        return fn
+    return decorator
+
+
+class JobContext:
+
+    def __init__(self, job_id):
+        self.job_id = job_id
+
+    def set_progress(self, progress):
+        """Store the progress (0-100). Commits the session, call it between units of work"""
+        db.session.execute(update(Job).where(Job.id == self.job_id)
+                           .values(progress=int(progress), locked_at=datetime.utcnow()))
+        db.session.commit()
+
+
+def enqueue(kind, payload=None, max_attempts=3, run_at=None, created_by=None):
+    if kind not in HANDLERS:
+        raise APIException(f"Unknown job kind {kind}", status_code=400)
+    now = datetime.utcnow()
+    job = Job(kind=kind, payload=payload, status='queued', progress=0, attempts=0,
+              max_attempts=max_attempts, run_at=run_at or now, created_at=now, created_by=created_by)
+    db.session.add(job)
+    db.session.commit()
+    return job
+
+
+def claim(worker_id):
+    """Mark the next due job as running and return it, None when there is nothing to do"""
+    now = datetime.utcnow()
+    due = (select(Job)
+           .where(Job.status == 'queued', Job.run_at <= now)
+           .order_by(Job.run_at)
+           .limit(1))
+    if db.engine.dialect.name == 'postgresql':
+        job = db.session.scalars(due.with_for_update(skip_locked=True)).first()
+        if job is None:
+            db.session.rollback()
+            return None
+        job.status = 'running'
+        job.locked_by = worker_id
+        job.locked_at = now
+        job.attempts += 1
+        db.session.commit()
+        return job
+
+    while True:
+        job_id = db.session.scalar(due.with_only_columns(Job.id))
+        if job_id is None:
+            db.session.rollback()
+            return None
+        claimed = db.session.execute(
+            update(Job)
+            .where(Job.id == job_id, Job.status == 'queued')
+            .values(status='running', locked_by=worker_id, locked_at=now, attempts=Job.attempts + 1))
+        db.session.commit()
+        if claimed.rowcount == 1:
+            return db.session.get(Job, job_id)
+        # another worker got it first, the next due job may still be free
+
+
+def _backoff(attempts, base, cap):
+    return timedelta(seconds=min(cap, base * 2 ** (attempts - 1)))
+
+
+def _heartbeat(engine, job_id, worker_id, stop, interval):
+    # own connection, the handler's session may be in the middle of a transaction
+    while not stop.wait(interval):
+        try:
+            with engine.begin() as conn:
+                conn.execute(update(Job).where(Job.id == job_id, Job.locked_by == worker_id)
+                             .values(locked_at=datetime.utcnow()))
+        except Exception:
+            logger.exception("Could not refresh the lock of job %s", job_id)
+
+
+def _run_handler(handler, job_id, worker_id, payload, heartbeat_interval):
+    stop = threading.Event()
+    heartbeat = threading.Thread(target=_heartbeat, args=(db.engine, job_id, worker_id, stop, heartbeat_interval),
+                                 name=f"job-heartbeat-{job_id}", daemon=True)
+    heartbeat.start()
+    try:
+        return handler(JobContext(job_id), payload)
+    finally:
+        stop.set()
+        heartbeat.join()
+
+
+def run_job(job, retry_base=10, retry_max=3600, heartbeat_interval=60):
+    job_id, kind, payload = job.id, job.kind, job.payload or {}
+    handler = HANDLERS.get(kind)
+    try:
+        if handler is None:
+            raise PermanentJobError(f"No handler for job kind {kind}")
+        result = _run_handler(handler, job_id, job.locked_by, payload, heartbeat_interval)
+    except Exception as e:
+        db.session.rollback()
+        job = db.session.get(Job, job_id)
+        permanent = isinstance(e, (PermanentJobError, APIException))
+        if isinstance(e, APIException):
+            job.last_error = str(e.to_dict())
+        elif isinstance(e, PermanentJobError):
+            job.last_error = str(e)
+        else:
+            job.last_error = traceback.format_exc(limit=5)
+        job.locked_by = None
+        job.locked_at = None
+        if permanent or job.attempts >= job.max_attempts:
+            job.status = 'failed'
+            job.finished_at = datetime.utcnow()
+            logger.warning("Job %s (%s) failed after %s attempts", job_id, kind, job.attempts)
+        else:
+            job.status = 'queued'
+            job.run_at = datetime.utcnow() + _backoff(job.attempts, retry_base, retry_max)
+            logger.info("Job %s (%s) failed, retrying at %s", job_id, kind, job.run_at)
+        db.session.commit()
+        return job
+
+    job = db.session.get(Job, job_id)
+    job.status = 'succeeded'
+    job.progress = 100
+    job.result = result
+    job.locked_by = None
+    job.locked_at = None
+    job.finished_at = datetime.utcnow()
+    db.session.commit()
+    return job
+
+
+def requeue_stale(lock_timeout):
+    """Jobs whose worker died while running them go back to the queue, or fail when out of attempts"""
+    limit = datetime.utcnow() - timedelta(seconds=lock_timeout)
+    stale = (Job.status == 'running', Job.locked_at < limit)
+    db.session.execute(update(Job).where(*stale, Job.attempts >= Job.max_attempts)
+                       .values(status='failed', last_error='Worker lost', locked_by=None,
+                               finished_at=datetime.utcnow()))
+    db.session.execute(update(Job).where(*stale).values(status='queued', locked_by=None, locked_at=None))
+    db.session.commit()
+
+
+def _work(app, worker_id, stop, poll_interval):
+    retry_base = app.config.get('JOB_RETRY_BASE', 10)
+    retry_max = app.config.get('JOB_RETRY_MAX', 3600)
+    heartbeat_interval = min(app.config.get('JOB_LOCK_TIMEOUT', 3600) / 4, 60)
+    while not stop.is_set():
+        job = None
+        with app.app_context():
+            try:
+                job = claim(worker_id)
+                if job is not None:
+                    logger.info("%s running job %s (%s)", worker_id, job.id, job.kind)
+                    run_job(job, retry_base, retry_max, heartbeat_interval)
+            except Exception:
+                logger.exception("%s could not process a job", worker_id)
+        if job is None:
+            stop.wait(poll_interval)
+
+
+def _run_threads(app, threads, stop, poll_interval):
+    prefix = f"{socket.gethostname()}:{os.getpid()}"
+    pool = [threading.Thread(target=_work, args=(app, f"{prefix}:{x}", stop, poll_interval),
+                             name=f"job-worker-{x}")
+            for x in range(threads)]
+    for thread in pool:
+        thread.start()
+    lock_timeout = app.config.get('JOB_LOCK_TIMEOUT', 3600)
+    while not stop.is_set():
+        with app.app_context():
+            try:
+                requeue_stale(lock_timeout)
+            except Exception:
+                logger.exception("Could not requeue stale jobs")
+        stop.wait(min(lock_timeout / 4, 60))
+    for thread in pool:
+        thread.join()
+
+
+def _process_main(app, threads, stop, poll_interval):
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, lambda signum, frame: stop.set())
+    # the pool was inherited from the parent, its connections belong to the parent
+    with app.app_context():
+        db.engine.dispose(close=False)
+    _run_threads(app, threads, stop, poll_interval)
+
+
+def run_worker(app, processes=1, threads=4, poll_interval=1.0):
+    """Run the job workers until SIGINT or SIGTERM"""
+    if processes <= 1:
+        stop = threading.Event()
+        signal.signal(signal.SIGTERM, lambda signum, frame: stop.set())
+        try:
+            _run_threads(app, threads, stop, poll_interval)
+        except KeyboardInterrupt:
+            stop.set()
+        return
+
+    context = multiprocessing.get_context('fork')
+    stop = context.Event()
+    children = [context.Process(target=_process_main, args=(app, threads, stop, poll_interval),
+                                name=f"job-worker-process-{x}")
+                for x in range(processes)]
+    for child in children:
+        child.start()
+    signal.signal(signal.SIGTERM, lambda signum, frame: stop.set())
+    try:
+        for child in children:
+            child.join()
+    except KeyboardInterrupt:
+        stop.set()
+        for child in children:
+            child.join()
+
+
+def setup_jobs(app):
+    app.config.setdefault('JOB_RETRY_BASE', 10)
+    app.config.setdefault('JOB_RETRY_MAX', 3600)
+    app.config.setdefault('JOB_LOCK_TIMEOUT', 3600)
+    # registers the handlers
+    import api.tasks  # noqa: F401
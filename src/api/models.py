@@ -64,13 +64,17 @@ personal_info_permits = db.Table(
     'personal_info_permits',
     db.Model.metadata,
     db.Column('personal_info_id', db.Integer, db.ForeignKey('personal_info.id'), primary_key=True),
-    db.Column('permit_id', db.Integer, db.ForeignKey('permits.id'), primary_key=True)
+    db.Column('permit_id', db.Integer, db.ForeignKey('permits.id'), primary_key=True),
+    # La clave primaria empieza por personal_info_id, este indice cubre la busqueda por permiso
+    db.Index('ix_personal_info_permits_permit_id', 'permit_id')
 )
 
 # Tabla intermedia para la relación N:N entre Permisos y Station
 permit_station = db.Table('permit_station',
     db.Column('permit_id', db.Integer, db.ForeignKey('permits.id'), primary_key=True),
-    db.Column('station_id', db.Integer, db.ForeignKey('stations.id'), primary_key=True)
+    db.Column('station_id', db.Integer, db.ForeignKey('stations.id'), primary_key=True),
+    # La clave primaria empieza por permit_id, este indice cubre la busqueda por estacion
+    db.Index('ix_permit_station_station_id', 'station_id')
 )
 
     
@@ -116,8 +120,8 @@ class Permit(db.Model):
         "control_number": self.control_number,
         "type": self.type,
         "status": self.status,
-        "start_date": self.start_date.isoformat(),
-        "end_date": self.end_date.isoformat(),
+        "start_date": self.start_date,
+        "end_date": self.end_date,
         "requester_id": self.requester_id,
         "approver_id": self.approver_id,
         "stations": [s.name for s in self.stations],
@@ -305,3 +309,79 @@ class Contractor(db.Model):
         }
     
 
+class AuditEvent(db.Model):
+    # Tabla append-only: solo se inserta desde api.audit, nunca se actualiza ni se borra
+    __tablename__ = 'audit_events'
+    __table_args__ = (
+        db.Index('ix_audit_events_entity', 'entity_type', 'entity_id', 'created_at'),
+        db.Index('ix_audit_events_created_at', 'created_at'),
+    )
+    id: Mapped[int] = mapped_column(primary_key=True)
+    entity_type: Mapped[str] = mapped_column(String(50), nullable=False)
+    entity_id: Mapped[int] = mapped_column(Integer, nullable=True)
+    action: Mapped[str] = mapped_column(String(50), nullable=False)
+    old_value: Mapped[str] = mapped_column(String(100), nullable=True)
+    new_value: Mapped[str] = mapped_column(String(100), nullable=True)
+    client: Mapped[str] = mapped_column(String(100), nullable=True)
+    path: Mapped[str] = mapped_column(String(200), nullable=True)
+    created_at: Mapped[datetime] = mapped_column(DateTime, nullable=False)
+
+    def __repr__(self):
+        return f'<AuditEvent {self.entity_type} {self.entity_id} {self.action}>'
+
+    def serialize(self):
+        return {
+            "id": self.id,
+            "entity_type": self.entity_type,
+            "entity_id": self.entity_id,
+            "action": self.action,
+            "old_value": self.old_value,
+            "new_value": self.new_value,
+            "client": self.client,
+            "path": self.path,
+            "created_at": self.created_at,
+        }
+
+
+class Job(db.Model):
+    # Cola de trabajos en segundo plano, ver api/jobs.py
+    __tablename__ = 'jobs'
+    __table_args__ = (
+        db.Index('ix_jobs_status_run_at', 'status', 'run_at'),
+        db.Index('ix_jobs_created_by', 'created_by'),
+    )
+    id: Mapped[int] = mapped_column(primary_key=True)
+    kind: Mapped[str] = mapped_column(String(50), nullable=False)
+    status: Mapped[str] = mapped_column(String(20), nullable=False, default='queued')
+    payload: Mapped[dict] = mapped_column(db.JSON, nullable=True)
+    result: Mapped[dict] = mapped_column(db.JSON, nullable=True)
+    progress: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    attempts: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    max_attempts: Mapped[int] = mapped_column(Integer, nullable=False, default=3)
+    last_error: Mapped[str] = mapped_column(db.Text, nullable=True)
+    locked_by: Mapped[str] = mapped_column(String(100), nullable=True)
+    locked_at: Mapped[datetime] = mapped_column(DateTime, nullable=True)
+    run_at: Mapped[datetime] = mapped_column(DateTime, nullable=False)
+    created_at: Mapped[datetime] = mapped_column(DateTime, nullable=False)
+    finished_at: Mapped[datetime] = mapped_column(DateTime, nullable=True)
+    # Usuario que encoló el trabajo, solo él puede consultarlo
+    created_by: Mapped[int] = mapped_column(Integer, ForeignKey('users.id'), nullable=True)
+
+    def __repr__(self):
+        return f'<Job {self.id} {self.kind} {self.status}>'
+
+    def serialize(self):
+        return {
+            "id": self.id,
+            "kind": self.kind,
+            "status": self.status,
+            "progress": self.progress,
+            "attempts": self.attempts,
+            "max_attempts": self.max_attempts,
+            "result": self.result,
+            "last_error": self.last_error,
+            "run_at": self.run_at,
+            "created_at": self.created_at,
+            "finished_at": self.finished_at,
+            "created_by": self.created_by,
+        }
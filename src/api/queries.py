@@ -0,0 +1,47 @@
+"""
+Queries shared by the endpoints and by the query-count checks in api/querycheck.py
+"""
+from sqlalchemy import select
+from sqlalchemy.orm import selectinload
+from api.models import Permit, PersonalInfo, personal_info_permits, permit_station
+
+
+def find_person(session, national_id):
+    return session.scalar(select(PersonalInfo).where(PersonalInfo.national_id == national_id))
+
+
+def check_access(session, person_id, station_id, at):
+    """Id of an approved permit that lets the person into the station at that time, None when denied"""
+    stmt = (select(Permit.id)
+            .join(personal_info_permits, personal_info_permits.c.permit_id == Permit.id)
+            .join(permit_station, permit_station.c.permit_id == Permit.id)
+            .where(personal_info_permits.c.personal_info_id == person_id,
+                   permit_station.c.station_id == station_id,
+                   Permit.status == 'approved',
+                   Permit.start_date <= at,
+                   Permit.end_date >= at)
+            .limit(1))
+    return session.scalar(stmt)
+
+
+def list_permits(session, limit=50, after_id=None):
+    """Permits ordered by id, with their stations and people loaded in two extra queries instead of 2 per permit"""
+    stmt = (select(Permit)
+            .options(selectinload(Permit.stations), selectinload(Permit.people))
+            .order_by(Permit.id)
+            .limit(limit))
+    if after_id is not None:
+        stmt = stmt.where(Permit.id > after_id)
+    return session.scalars(stmt).all()
+
+
+def station_overlaps(session, station_id, start, end):
+    """Permits of a station whose dates overlap [start, end)"""
+    stmt = (select(Permit)
+            .join(permit_station, permit_station.c.permit_id == Permit.id)
+            .where(permit_station.c.station_id == station_id,
+                   Permit.start_date < end,
+                   Permit.end_date > start)
+            .options(selectinload(Permit.stations), selectinload(Permit.people))
+            .order_by(Permit.start_date))
+    return session.scalars(stmt).all()
@@ -0,0 +1,249 @@
+"""
+Query-count and query-plan regression checks.
+
+Every relationship in models.py is lazy, so a small change in a serialize()
+method can silently turn one query into N+1. This module counts the statements
+that the key queries of api/queries.py and the endpoints send to the database,
+captures their EXPLAIN output and compares both against the budgets stored in
+query_budgets.json. A count must match its budget exactly. Run it with:
+
+    $ flask check-queries              # sqlite, plus postgres if QUERYCHECK_POSTGRES_URL is set
+    $ flask check-queries --update     # accept the current counts and plans as the new budgets
+
+tests/test_query_counts.py asserts the same counts with pytest (pipenv run test).
+
+The checks always run on a scratch database that is created and dropped by the
+command, QUERYCHECK_POSTGRES_URL must point to a database that can be wiped.
+Only sqlite has a committed budget so far. A dialect without one is skipped
+until its budget is recorded with --update.
+"""
+import json
+import os
+import re
+import secrets
+import tempfile
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from flask import Flask
+from sqlalchemy import event
+from api.models import db, User, Department, Permit, Station, Region, Market, PersonalInfo
+from api.queries import find_person, check_access, list_permits, station_overlaps
+
+BUDGETS_FILE = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'query_budgets.json')
+
+SEED_PERMITS = 20
+CHECK_TIME = datetime(2026, 1, 15, 12, 0)
+
+
+class QueryCounter:
+    """Collects every statement sent through an engine while it is active"""
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.statements = []
+
+    def _before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        self.statements.append((statement, parameters, executemany))
+
+    def __enter__(self):
+        event.listen(self.engine, 'before_cursor_execute', self._before_cursor_execute)
+        return self
+
+    def __exit__(self, *exc):
+        event.remove(self.engine, 'before_cursor_execute', self._before_cursor_execute)
+
+    @property
+    def count(self):
+        return len(self.statements)
+
+
+@contextmanager
+def assert_num_queries(expected, engine=None):
+    """
+    Fail unless exactly `expected` statements run inside the block:
+
+        with assert_num_queries(3):
+            [p.serialize() for p in list_permits(db.session)]
+    """
+    with QueryCounter(engine or db.engine) as counter:
+        yield counter
+    if counter.count != expected:
+        listing = "\n".join(f"  {i + 1}. {s}" for i, (s, p, m) in enumerate(counter.statements))
+        raise AssertionError(f"Expected {expected} queries, got {counter.count}:\n{listing}")
+
+
+# The key queries are the ones run by the endpoints, see api/queries.py
+# name -> (function(session), tables that must never be scanned sequentially)
+KEY_QUERIES = {
+    "permit_listing": (
+        lambda session: [p.serialize() for p in list_permits(session)],
+        {"permit_station", "personal_info_permits", "stations", "personal_info"},
+    ),
+    "access_check": (
+        lambda session: check_access(session, find_person(session, "0000001").id, 1, CHECK_TIME),
+        {"personal_info", "personal_info_permits", "permits", "permit_station"},
+    ),
+    "station_overlap": (
+        lambda session: [p.serialize() for p in station_overlaps(session, 1, CHECK_TIME,
+                                                                 CHECK_TIME + timedelta(days=1))],
+        {"permit_station", "permits", "stations", "personal_info_permits", "personal_info"},
+    ),
+}
+
+# endpoint -> path requested with the test client
+ENDPOINTS = {
+    "GET /api/hello": "/api/hello",
+    "GET /api/audit": "/api/audit?entity_type=Permit&entity_id=1",
+    "GET /api/access": "/api/access?national_id=0000001&station_id=2&at=2026-01-15T12:00:00",
+    "GET /api/permits": "/api/permits?limit=50",
+    "GET /api/stations/<id>/permits": "/api/stations/1/permits?start=2026-01-15T12:00:00&end=2026-01-16T12:00:00",
+}
+
+
+def seed(session, permits=SEED_PERMITS):
+    department = Department(name="Operations")
+    user = User(name="Requester", email="requester@test.com", password="123456", employee_id="0000001",
+                department=department)
+    region = Region(region="North")
+    market = Market(name="North market", region=region)
+    stations = [Station(id=x, name=f"Station {x}", coordenates="0,0", address=f"Road {x}", region=region,
+                        market=market)
+                for x in range(1, 4)]
+    for x in range(1, permits + 1):
+        person = PersonalInfo(full_name=f"Person {x}", national_id=f"{x:07d}", is_allow=True)
+        session.add(Permit(control_number=f"P-{x:05d}", type="hot work", status="approved",
+                           start_date=CHECK_TIME - timedelta(days=x % 3), end_date=CHECK_TIME + timedelta(days=1),
+                           user_requester=user, people=[person], stations=[stations[x % 3]]))
+    session.commit()
+
+
+def explain(conn, statement, parameters):
+    """Return the plan of a captured statement as a list of lines"""
+    if conn.dialect.name == 'sqlite':
+        rows = conn.exec_driver_sql("EXPLAIN QUERY PLAN " + statement, parameters).fetchall()
+        return [row[-1] for row in rows]
+    if conn.dialect.name == 'postgresql':
+        # tiny tables are always scanned, disable seq scans so only a missing index produces one
+        conn.exec_driver_sql("SET LOCAL enable_seqscan = off")
+        rows = conn.exec_driver_sql("EXPLAIN " + statement, parameters).fetchall()
+        return [row[0] for row in rows]
+    return []
+
+
+_SEQ_SCAN = {
+    'sqlite': re.compile(r'^SCAN (\w+?)(?:_\d+)?(?: |$)(?!.*INDEX)'),
+    'postgresql': re.compile(r'Seq Scan on (\w+)'),
+}
+
+
+def seq_scans(dialect, plan, tables):
+    pattern = _SEQ_SCAN.get(dialect)
+    if pattern is None:
+        return []
+    found = []
+    for line in plan:
+        match = pattern.search(line.strip())
+        if match and match.group(1) in tables:
+            found.append(line.strip())
+    return found
+
+
+def make_scratch_app(database_url):
+    """A bare app with only the api blueprint, bound to a database that can be wiped"""
+    from flask_jwt_extended import JWTManager
+    from api.routes import api
+    from api.json_provider import FastJSONProvider
+    from api.utils import APIException
+    app = Flask(__name__)
+    app.json = FastJSONProvider(app)
+    app.config['SQLALCHEMY_DATABASE_URI'] = database_url
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    # tokens only live as long as the scratch app
+    app.config['JWT_SECRET_KEY'] = secrets.token_hex(32)
+    JWTManager(app)
+    db.init_app(app)
+    app.register_blueprint(api, url_prefix='/api')
+    app.register_error_handler(APIException, lambda error: (error.to_dict(), error.status_code))
+    return app
+
+
+def make_token(app, identity=1, **claims):
+    """A bearer token accepted by the app, claims as created by `flask create-token`"""
+    from flask_jwt_extended import create_access_token
+    with app.app_context():
+        return create_access_token(identity=str(identity), additional_claims=claims)
+
+
+def run_checks(database_url):
+    """Seed a scratch database and return {"counts": {...}, "plans": {...}, "scans": [...]}"""
+    app = make_scratch_app(database_url)
+    report = {"counts": {}, "plans": {}, "scans": []}
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        try:
+            seed(db.session)
+            dialect = db.engine.dialect.name
+            for name, (run, indexed) in KEY_QUERIES.items():
+                db.session.expunge_all()
+                with QueryCounter(db.engine) as counter:
+                    run(db.session)
+                db.session.rollback()
+                report["counts"][name] = counter.count
+                plans = []
+                with db.engine.connect() as conn:
+                    for statement, parameters, executemany in counter.statements:
+                        if executemany or not statement.lstrip().upper().startswith("SELECT"):
+                            continue
+                        plan = explain(conn, statement, parameters)
+                        conn.rollback()
+                        plans.append(plan)
+                        report["scans"] += [f"{name}: {line}" for line in seq_scans(dialect, plan, indexed)]
+                report["plans"][name] = plans
+
+            client = app.test_client()
+            headers = {'Authorization': 'Bearer ' + make_token(app, audit=True)}
+            for name, path in ENDPOINTS.items():
+                db.session.remove()
+                with QueryCounter(db.engine) as counter:
+                    client.get(path, headers=headers)
+                report["counts"][name] = counter.count
+        finally:
+            db.session.remove()
+            db.drop_all()
+    return report
+
+
+def compare(report, budget):
+    """List the regressions of a report against the stored budget for the same dialect"""
+    failures = list(f"sequential scan on an indexed path, {scan}" for scan in report["scans"])
+    counts = budget.get("counts", {})
+    for name, count in report["counts"].items():
+        if name not in counts:
+            failures.append(f"{name}: no budget recorded, run with --update")
+        elif count != counts[name]:
+            # fewer queries is also reported, so the budget never drifts above what the code needs
+            failures.append(f"{name}: {count} queries, budget is {counts[name]}, run with --update if intended")
+    return failures
+
+
+def load_budgets():
+    if not os.path.isfile(BUDGETS_FILE):
+        return {}
+    with open(BUDGETS_FILE) as f:
+        return json.load(f)
+
+
+def save_budgets(budgets):
+    with open(BUDGETS_FILE, 'w') as f:
+        json.dump(budgets, f, indent=2, sort_keys=True)
+        f.write("\n")
+
+
+def database_targets():
+    """sqlite is always checked, postgres only when a scratch database is configured"""
+    targets = {"sqlite": "sqlite:///" + os.path.join(tempfile.gettempdir(), "querycheck.db")}
+    postgres_url = os.getenv("QUERYCHECK_POSTGRES_URL")
+    if postgres_url:
+        targets["postgresql"] = postgres_url.replace("postgres://", "postgresql://")
+    return targets
@@ -1,9 +1,21 @@
 """
 This module takes care of starting the API Server, Loading the DB and Adding the endpoints
 """
-from flask import Flask, request, jsonify, url_for, Blueprint
-from api.models import db, User
+import copy
+from datetime import datetime
+from functools import wraps
+from flask import Flask, request, jsonify, url_for, Blueprint, current_app
+from flask_swagger import swagger
+from flask_jwt_extended import jwt_required, get_jwt, get_jwt_identity
+from api.models import db, User, Job
 from api.utils import generate_sitemap, APIException
+from api.schemas import SCHEMAS, validate, parse_datetime
+from api.audit import query_events, audit_access, set_audit_entity
+from api.queries import find_person, check_access, list_permits, station_overlaps
+from api.batch import parse_batch, run_batch, batch_cost
+from api.admission import admission_class
+from api.jobs import enqueue
+from sqlalchemy import select
 from flask_cors import CORS
 
 api = Blueprint('api', __name__)
@@ -14,9 +26,348 @@ CORS(api)
 
 @api.route('/hello', methods=['POST', 'GET'])
 def handle_hello():
+    """
+    Sample endpoint
+    ---
+    tags: [meta]
+    responses:
+      200:
+        description: A greeting message
+    """
 
     response_body = {
         "message": "Hello! I'm a message that came from the backend, check the network tab on the google inspector and you will see the GET request"
     }
 
     return jsonify(response_body), 200
+
+
+# the spec only changes when the code changes, so it is generated once per process
+_spec_cache = {}
+
+
+@api.route('/spec', methods=['GET'])
+def handle_spec():
+    """
+    Swagger 2.0 description of this API, built from the endpoint docstrings
+    ---
+    tags: [meta]
+    responses:
+      200:
+        description: The swagger document
+    """
+    if 'spec' not in _spec_cache:
+        template = {"info": {"title": "SAET API", "version": "1.0"}, "basePath": "/",
+                    "definitions": copy.deepcopy(SCHEMAS),
+                    "securityDefinitions": {"bearer": {"type": "apiKey", "in": "header", "name": "Authorization",
+                                                       "description": "Bearer <token from flask create-token>"}}}
+        _spec_cache['spec'] = swagger(current_app, prefix='/api', template=template)
+    return jsonify(_spec_cache['spec']), 200
+
+
+def token_required(view):
+    """jwt_required(), answering 503 while no JWT_SECRET_KEY is configured (see app.py)"""
+    protected = jwt_required()(view)
+
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        if not current_app.config.get('JWT_SECRET_KEY'):
+            raise APIException("Token authentication is not configured", status_code=503)
+        return protected(*args, **kwargs)
+    return wrapper
+
+
+def _parse_datetime(name):
+    value = request.args.get(name)
+    if value is None:
+        return None
+    try:
+        return parse_datetime(value)
+    except ValueError:
+        raise APIException(f"{name} must be an ISO 8601 date", status_code=400)
+
+
+@api.route('/audit', methods=['GET'])
+@token_required
+def handle_audit():
+    """
+    Audit events, newest first. The token must be created with --audit
+    ---
+    tags: [audit]
+    security: [{bearer: []}]
+    parameters:
+      - {name: entity_type, in: query, type: string, description: "Permit or PersonalInfo"}
+      - {name: entity_id, in: query, type: integer}
+      - {name: since, in: query, type: string, format: date-time}
+      - {name: until, in: query, type: string, format: date-time}
+      - {name: limit, in: query, type: integer, default: 100, maximum: 1000}
+    responses:
+      200:
+        description: List of audit events
+      400:
+        description: Invalid date
+      401:
+        description: Missing or invalid token
+      503:
+        description: No JWT_SECRET_KEY configured
+      403:
+        description: The token may not read the audit log
+    """
+    # the events include the client address of every gate check
+    if not get_jwt().get('audit'):
+        raise APIException("Not allowed to read the audit log", status_code=403)
+    entity_id = request.args.get('entity_id', type=int)
+    limit = min(request.args.get('limit', 100, type=int), 1000)
+    events = query_events(entity_type=request.args.get('entity_type'), entity_id=entity_id,
+                          since=_parse_datetime('since'), until=_parse_datetime('until'), limit=limit)
+    return jsonify([e.serialize() for e in events]), 200
+
+
+@api.route('/access', methods=['GET'])
+@admission_class('gate')
+@audit_access('PersonalInfo')
+def handle_access_check():
+    """
+    Gate check, can this person enter this station now (or at the given time)
+    ---
+    tags: [access]
+    parameters:
+      - {name: national_id, in: query, type: string, required: true}
+      - {name: station_id, in: query, type: integer, required: true}
+      - {name: at, in: query, type: string, format: date-time}
+    responses:
+      200:
+        description: Allowed, with the permit that grants the access
+      403:
+        description: Denied
+      400:
+        description: Missing parameters
+    """
+    national_id = request.args.get('national_id')
+    station_id = request.args.get('station_id', type=int)
+    if not national_id or station_id is None:
+        raise APIException("national_id and station_id are required", status_code=400)
+    at = _parse_datetime('at') or datetime.utcnow()
+    person = find_person(db.session, national_id)
+    permit_id = None
+    if person is not None:
+        set_audit_entity(person.id)
+        if person.is_allow:
+            permit_id = check_access(db.session, person.id, station_id, at)
+    if permit_id is None:
+        return jsonify({"allowed": False}), 403
+    return jsonify({"allowed": True, "permit_id": permit_id}), 200
+
+
+@api.route('/permits', methods=['GET'])
+def handle_list_permits():
+    """
+    Permits ordered by id, with their stations and people
+    ---
+    tags: [permits]
+    parameters:
+      - {name: limit, in: query, type: integer, default: 50, maximum: 500}
+      - {name: after_id, in: query, type: integer, description: "id of the last permit of the previous page"}
+    responses:
+      200:
+        description: List of permits
+    """
+    limit = min(request.args.get('limit', 50, type=int), 500)
+    permits = list_permits(db.session, limit=limit, after_id=request.args.get('after_id', type=int))
+    return jsonify([p.serialize() for p in permits]), 200
+
+
+@api.route('/stations/<int:station_id>/permits', methods=['GET'])
+def handle_station_permits(station_id):
+    """
+    Permits of a station that overlap a period
+    ---
+    tags: [permits]
+    parameters:
+      - {name: station_id, in: path, type: integer, required: true}
+      - {name: start, in: query, type: string, format: date-time, required: true}
+      - {name: end, in: query, type: string, format: date-time, required: true}
+    responses:
+      200:
+        description: List of permits
+      400:
+        description: Missing or invalid dates
+    """
+    start, end = _parse_datetime('start'), _parse_datetime('end')
+    if start is None or end is None:
+        raise APIException("start and end are required", status_code=400)
+    if end <= start:
+        raise APIException("end must be after start", status_code=400)
+    return jsonify([p.serialize() for p in station_overlaps(db.session, station_id, start, end)]), 200
+
+
+@api.route('/batch', methods=['POST'])
+@admission_class('batch', cost=batch_cost)
+def handle_batch():
+    """
+    Run several GET/POST requests against this API in one round trip
+    ---
+    tags: [batch]
+    parameters:
+      - in: body
+        name: body
+        required: true
+        schema:
+          type: object
+          required: [requests]
+          properties:
+            requests:
+              type: array
+              maxItems: 20
+              items:
+                type: object
+                required: [path]
+                properties:
+                  method: {type: string, default: GET}
+                  path: {type: string, example: /api/hello}
+                  body: {type: object}
+    responses:
+      200:
+        description: One {status, body} entry per sub-request, in the same order
+      400:
+        description: Invalid batch
+    """
+    items = parse_batch(request.get_json(silent=True), current_app.config.get('BATCH_MAX_REQUESTS', 20))
+    return jsonify({"responses": run_batch(items)}), 200
+
+
+@api.route('/admission', methods=['GET'])
+def handle_admission_stats():
+    """
+    Admission control counters of the worker that answers
+    ---
+    tags: [meta]
+    responses:
+      200:
+        description: Counters by endpoint class and decision
+    """
+    return jsonify(dict(current_app.extensions['admission'].stats)), 200
+
+
+def _job_owner():
+    return int(get_jwt_identity())
+
+
+def _own_jobs(stmt):
+    # a token only sees the jobs it queued
+    return stmt.where(Job.created_by == _job_owner())
+
+
+@api.route('/jobs', methods=['POST'])
+@token_required
+def handle_create_job():
+    """
+    Queue a background job, the token must allow its kind
+    ---
+    tags: [jobs]
+    security: [{bearer: []}]
+    parameters:
+      - in: body
+        name: body
+        required: true
+        schema:
+          $ref: "#/definitions/Job"
+    responses:
+      202:
+        description: The queued job, its url is in the Location header
+      400:
+        description: Invalid payload or unknown job kind
+      401:
+        description: Missing or invalid token
+      503:
+        description: No JWT_SECRET_KEY configured
+      403:
+        description: The token does not allow this job kind
+    """
+    body = validate('Job', request.get_json(silent=True))
+    if body['kind'] not in get_jwt().get('job_kinds', []):
+        raise APIException(f"Not allowed to queue {body['kind']} jobs", status_code=403)
+    max_attempts = max(1, min(body.get('max_attempts', 3), 10))
+    job = enqueue(body['kind'], body.get('payload'), max_attempts=max_attempts, created_by=_job_owner())
+    return jsonify(job.serialize()), 202, {'Location': url_for('api.handle_get_job', job_id=job.id)}
+
+
+@api.route('/jobs', methods=['GET'])
+@token_required
+def handle_list_jobs():
+    """
+    Latest jobs queued with the caller's token
+    ---
+    tags: [jobs]
+    security: [{bearer: []}]
+    parameters:
+      - {name: status, in: query, type: string, enum: [queued, running, succeeded, failed]}
+      - {name: kind, in: query, type: string}
+      - {name: limit, in: query, type: integer, default: 50, maximum: 500}
+    responses:
+      200:
+        description: List of jobs
+      401:
+        description: Missing or invalid token
+      503:
+        description: No JWT_SECRET_KEY configured
+    """
+    stmt = _own_jobs(select(Job)).order_by(Job.id.desc()).limit(min(request.args.get('limit', 50, type=int), 500))
+    if request.args.get('status'):
+        stmt = stmt.where(Job.status == request.args['status'])
+    if request.args.get('kind'):
+        stmt = stmt.where(Job.kind == request.args['kind'])
+    return jsonify([job.serialize() for job in db.session.scalars(stmt)]), 200
+
+
+@api.route('/jobs/<int:job_id>', methods=['GET'])
+@token_required
+def handle_get_job(job_id):
+    """
+    Status, progress and result of a job
+    ---
+    tags: [jobs]
+    security: [{bearer: []}]
+    parameters:
+      - {name: job_id, in: path, type: integer, required: true}
+    responses:
+      200:
+        description: The job
+      401:
+        description: Missing or invalid token
+      503:
+        description: No JWT_SECRET_KEY configured
+      404:
+        description: Job not found
+    """
+    job = db.session.scalar(_own_jobs(select(Job).where(Job.id == job_id)))
+    if job is None:
+        raise APIException("Job not found", status_code=404)
+    return jsonify(job.serialize()), 200
+
+
+@api.route('/jobs/<int:job_id>/progress', methods=['GET'])
+@token_required
+def handle_job_progress(job_id):
+    """
+    Status and progress of a job, for polling
+    ---
+    tags: [jobs]
+    security: [{bearer: []}]
+    parameters:
+      - {name: job_id, in: path, type: integer, required: true}
+    responses:
+      200:
+        description: id, status and progress
+      401:
+        description: Missing or invalid token
+      503:
+        description: No JWT_SECRET_KEY configured
+      404:
+        description: Job not found
+    """
+    # cheap endpoint for polling, does not load the payload or the result
+    row = db.session.execute(_own_jobs(select(Job.id, Job.status, Job.progress).where(Job.id == job_id))).first()
+    if row is None:
+        raise APIException("Job not found", status_code=404)
+    return jsonify({"id": row.id, "status": row.status, "progress": row.progress}), 200
@@ -0,0 +1,236 @@
+"""
+Request payload schemas.
+
+Each schema is declared once as a JSON-Schema style dict and compiled at import
+time into a plain python validator, so a request only pays for a handful of
+function calls per field instead of re-reading the schema on every payload.
+The same dicts are published as swagger definitions in /api/spec, so they only
+use Swagger 2.0 keywords plus two vendor extensions: x-nullable, and x-before,
+a list of [earlier, later] field pairs checked after the fields themselves.
+"""
+from datetime import datetime, timezone
+from api.utils import APIException
+
+PERMIT_STATUSES = ['pending', 'approved', 'rejected', 'cancelled']
+
+SCHEMAS = {
+    "Permit": {
+        "type": "object",
+        "required": ["control_number", "type", "start_date", "end_date", "requester_id"],
+        "properties": {
+            "control_number": {"type": "string", "maxLength": 20, "minLength": 1},
+            "type": {"type": "string", "maxLength": 50, "minLength": 1},
+            "status": {"type": "string", "enum": PERMIT_STATUSES},
+            "start_date": {"type": "string", "format": "date-time"},
+            "end_date": {"type": "string", "format": "date-time"},
+            "requester_id": {"type": "integer"},
+            "approver_id": {"type": "integer", "x-nullable": True},
+            "stations": {"type": "array", "items": {"type": "integer"}},
+            "people": {"type": "array", "items": {"type": "integer"}},
+        },
+        "x-before": [["start_date", "end_date"]],
+    },
+    "PersonalInfo": {
+        "type": "object",
+        "required": ["full_name", "national_id"],
+        "properties": {
+            "full_name": {"type": "string", "maxLength": 100, "minLength": 1},
+            "national_id": {"type": "string", "maxLength": 7, "minLength": 1},
+            "is_allow": {"type": "boolean"},
+            "permits": {"type": "array", "items": {"type": "integer"}},
+        },
+    },
+    "Contractor": {
+        "type": "object",
+        "required": ["company_name", "contact_email", "contact_phone", "personal_info_id"],
+        "properties": {
+            "company_name": {"type": "string", "maxLength": 100, "minLength": 1},
+            "contact_email": {"type": "string", "maxLength": 120, "format": "email"},
+            "contact_phone": {"type": "string", "maxLength": 20, "minLength": 1},
+            "personal_info_id": {"type": "integer"},
+        },
+    },
+    "Station": {
+        "type": "object",
+        "required": ["name", "coordenates", "address", "region_id", "market_id"],
+        "properties": {
+            "name": {"type": "string", "maxLength": 100, "minLength": 1},
+            "coordenates": {"type": "string", "maxLength": 100, "minLength": 1},
+            "address": {"type": "string", "maxLength": 200, "minLength": 1},
+            "region_id": {"type": "integer"},
+            "market_id": {"type": "integer"},
+        },
+    },
+    "Job": {
+        "type": "object",
+        "required": ["kind"],
+        "properties": {
+            "kind": {"type": "string", "maxLength": 50, "minLength": 1},
+            "payload": {"type": "object", "x-nullable": True},
+            "max_attempts": {"type": "integer"},
+        },
+    },
+}
+
+
+# python types accepted for every json type, bool is excluded from integer on purpose
+_TYPES = {
+    "string": (str,),
+    "integer": (int,),
+    "boolean": (bool,),
+    "array": (list,),
+    "object": (dict,),
+}
+
+
+def parse_datetime(value):
+    """
+    Parse an ISO 8601 date, including the trailing Z written by javascript's
+    toISOString() that datetime.fromisoformat rejects before python 3.11.
+    Aware dates are converted to naive UTC, the way they are stored
+    """
+    if value.endswith(('Z', 'z')):
+        value = value[:-1] + '+00:00'
+    parsed = datetime.fromisoformat(value)
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    return parsed
+
+
+def _is_datetime(value):
+    try:
+        parse_datetime(value)
+    except ValueError:
+        return False
+    return True
+
+
+def _is_email(value):
+    user, _, domain = value.partition("@")
+    return bool(user) and "." in domain
+
+
+_FORMATS = {
+    "date-time": _is_datetime,
+    "email": _is_email,
+}
+
+
+def _compile_field(spec):
+    """Turn a property spec into a function returning an error message or None"""
+    types = _TYPES[spec["type"]]
+    is_integer = spec["type"] == "integer"
+    nullable = spec.get("x-nullable", False)
+    checks = []
+
+    if "minLength" in spec:
+        min_length = spec["minLength"]
+        checks.append(lambda v: f"must have at least {min_length} characters" if len(v) < min_length else None)
+    if "maxLength" in spec:
+        max_length = spec["maxLength"]
+        checks.append(lambda v: f"must have at most {max_length} characters" if len(v) > max_length else None)
+    if "enum" in spec:
+        choices = frozenset(spec["enum"])
+        message = "must be one of " + ", ".join(spec["enum"])
+        checks.append(lambda v: message if v not in choices else None)
+    if "format" in spec:
+        is_valid = _FORMATS[spec["format"]]
+        message = "must be a valid " + spec["format"]
+        checks.append(lambda v: message if not is_valid(v) else None)
+    if "items" in spec:
+        check_item = _compile_field(spec["items"])
+
+        def check_items(values):
+            for i, item in enumerate(values):
+                error = check_item(item)
+                if error is not None:
+                    return f"item {i} {error}"
+            return None
+        checks.append(check_items)
+
+    type_error = "must be of type " + spec["type"]
+
+    def check(value):
+        if value is None:
+            return None if nullable else "may not be null"
+        if not isinstance(value, types) or (is_integer and isinstance(value, bool)):
+            return type_error
+        for c in checks:
+            error = c(value)
+            if error is not None:
+                return error
+        return None
+
+    return check
+
+
+def compile_schema(schema):
+    """
+    Compile an object schema into a validator. The validator receives a payload
+    and returns a dict of {field: message}, empty when the payload is valid
+    """
+    required = tuple(schema.get("required", ()))
+    fields = tuple((name, _compile_field(spec)) for name, spec in schema["properties"].items())
+    allowed = frozenset(schema["properties"])
+    # only date-time fields can be ordered for now
+    ordered = tuple(schema.get("x-before", ()))
+
+    def validator(payload):
+        if not isinstance(payload, dict):
+            return {"_": "must be an object"}
+        errors = {}
+        for name in required:
+            if name not in payload:
+                errors[name] = "is required"
+        for name, check in fields:
+            if name in payload:
+                error = check(payload[name])
+                if error is not None:
+                    errors[name] = error
+        if len(payload) > len(allowed) or not allowed.issuperset(payload):
+            for name in payload:
+                if name not in allowed:
+                    errors[name] = "is not allowed"
+        for earlier, later in ordered:
+            if payload.get(earlier) is None or payload.get(later) is None or earlier in errors or later in errors:
+                continue
+            if parse_datetime(payload[later]) <= parse_datetime(payload[earlier]):
+                errors[later] = f"must be after {earlier}"
+        return errors
+
+    return validator
+
+
+# compiled once when the module is imported and reused by every request
+VALIDATORS = {name: compile_schema(schema) for name, schema in SCHEMAS.items()}
+
+
+def validate(schema_name, payload):
+    """Validate a single payload, raises APIException(400) with the field errors"""
+    errors = VALIDATORS[schema_name](payload)
+    if errors:
+        raise APIException(f"Invalid {schema_name} payload", status_code=400, payload={"errors": errors})
+    return payload
+
+
+def validate_many(schema_name, items, max_errors=100):
+    """
+    Validate an array of payloads. All items are checked and the errors are
+    aggregated by index, up to max_errors reported items, so a client uploading
+    thousands of rows gets one report instead of failing on the first bad row
+    """
+    if not isinstance(items, list):
+        raise APIException(f"Expected an array of {schema_name} items", status_code=400)
+    validator = VALIDATORS[schema_name]
+    report = []
+    invalid = 0
+    for index, item in enumerate(items):
+        errors = validator(item)
+        if errors:
+            invalid += 1
+            if len(report) < max_errors:
+                report.append({"index": index, "errors": errors})
+    if invalid:
+        raise APIException(f"{invalid} of {len(items)} {schema_name} items are invalid", status_code=400,
+                           payload={"errors": report, "invalid": invalid, "total": len(items)})
+    return items
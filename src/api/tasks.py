@@ -0,0 +1,93 @@
+"""
+Background job handlers, run by `flask worker` (see api/jobs.py).
+
+Each handler receives a JobContext and the job payload, and returns a JSON
+serializable result that is stored in the job row.
+"""
+import csv
+import io
+from collections import Counter
+from sqlalchemy import func, select
+from sqlalchemy.exc import IntegrityError
+from api.models import db, Permit, PersonalInfo
+from api.schemas import validate_many
+from api.jobs import job_handler, PermanentJobError
+
+IMPORT_CHUNK_SIZE = 500
+
+
+@job_handler('personal_info.import')
+def import_personal_info(ctx, payload):
+    """
+    Bulk insert of {"items": [PersonalInfo, ...]}, committed in chunks. People
+    whose national_id already exists are skipped, so a retry after a partial
+    import goes on from the last committed chunk instead of failing on it
+    """
+    items = validate_many('PersonalInfo', payload.get('items'))
+    duplicates = sorted(national_id for national_id, count in Counter(i['national_id'] for i in items).items()
+                        if count > 1)
+    if duplicates:
+        raise PermanentJobError("Repeated national_id in the payload: " + ", ".join(duplicates[:20]))
+
+    imported = skipped = 0
+    for start in range(0, len(items), IMPORT_CHUNK_SIZE):
+        chunk = items[start:start + IMPORT_CHUNK_SIZE]
+        existing = set(db.session.scalars(
+            select(PersonalInfo.national_id).where(PersonalInfo.national_id.in_([i['national_id'] for i in chunk]))))
+        for item in chunk:
+            if item['national_id'] in existing:
+                skipped += 1
+                continue
+            person = PersonalInfo(full_name=item['full_name'], national_id=item['national_id'],
+                                  is_allow=item.get('is_allow', False))
+            if item.get('permits'):
+                person.permits = db.session.scalars(select(Permit).where(Permit.id.in_(item['permits']))).all()
+            db.session.add(person)
+            imported += 1
+        try:
+            # commits the chunk, 100 is only set when the job is marked as succeeded
+            ctx.set_progress(min(99, (start + len(chunk)) * 100 // len(items)))
+        except IntegrityError as e:
+            # the same rows would fail again on every retry
+            raise PermanentJobError(f"Items {start} to {start + len(chunk) - 1} could not be saved: {e.orig}")
+    return {"imported": imported, "skipped": skipped}
+
+
+@job_handler('permits.report')
+def permits_report(ctx, payload):
+    """Number of permits per status and type"""
+    rows = db.session.execute(
+        select(Permit.status, Permit.type, func.count(Permit.id)).group_by(Permit.status, Permit.type)).all()
+    report = {}
+    for status, permit_type, count in rows:
+        report.setdefault(status, {})[permit_type] = count
+    return {"permits": report}
+
+
+@job_handler('permits.export')
+def export_permits(ctx, payload):
+    """CSV export of every permit, uploaded to Cloudinary (configured through CLOUDINARY_URL)"""
+    try:
+        import cloudinary
+        import cloudinary.uploader
+    except ImportError:
+        raise PermanentJobError("cloudinary is not installed")
+    if not cloudinary.config().cloud_name:
+        raise PermanentJobError("CLOUDINARY_URL is not configured")
+
+    output = io.StringIO()
+    writer = csv.writer(output)
+    writer.writerow(["id", "control_number", "type", "status", "start_date", "end_date", "requester_id",
+                     "approver_id"])
+    rows = 0
+    stmt = select(Permit.id, Permit.control_number, Permit.type, Permit.status, Permit.start_date,
+                  Permit.end_date, Permit.requester_id, Permit.approver_id).order_by(Permit.id)
+    for row in db.session.execute(stmt.execution_options(yield_per=1000)):
+        writer.writerow(row)
+        rows += 1
+    # set_progress commits, so it has to wait until the rows are streamed
+    ctx.set_progress(50)
+
+    upload = cloudinary.uploader.upload(io.BytesIO(output.getvalue().encode()), resource_type='raw',
+                                        public_id=f"exports/permits-{ctx.job_id}.csv")
+    return {"rows": rows, "url": upload['secure_url']}
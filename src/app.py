@@ -2,14 +2,22 @@
 This module takes care of starting the API Server, Loading the DB and Adding the endpoints
 """
 import os
+from datetime import timedelta
 from flask import Flask, request, jsonify, url_for, send_from_directory
 from flask_migrate import Migrate
+from werkzeug.middleware.proxy_fix import ProxyFix
 from flask_swagger import swagger
+from flask_jwt_extended import JWTManager
 from api.utils import APIException, generate_sitemap
 from api.models import db
 from api.routes import api
 from api.admin import setup_admin
 from api.commands import setup_commands
+from api.audit import setup_audit
+from api.json_provider import FastJSONProvider
+from api.compression import setup_compression
+from api.admission import setup_admission
+from api.jobs import setup_jobs
 
 # from models import Person
 
@@ -18,6 +26,10 @@ static_file_dir = os.path.join(os.path.dirname(
     os.path.realpath(__file__)), '../public/')
 app = Flask(__name__)
 app.url_map.strict_slashes = False
+# trust X-Forwarded-For from the proxies in front of gunicorn (1 on render/heroku),
+# request.remote_addr is then the real client and the raw header is never read
+app.wsgi_app = ProxyFix(app.wsgi_app, x_for=int(os.getenv("TRUSTED_PROXIES", 1)))
+app.json = FastJSONProvider(app)
 
 # database condiguration
 db_url = os.getenv("DATABASE_URL")
@@ -28,15 +40,71 @@ else:
     app.config['SQLALCHEMY_DATABASE_URI'] = "sqlite:////tmp/test.db"
 
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+# db.session is scoped to the app context, which lives in a contextvar, so each
+# thread (gthread) or greenlet (gevent) request gets its own session. The pool
+# only has to match the concurrency of one worker, see gunicorn.conf.py
+if not app.config['SQLALCHEMY_DATABASE_URI'].startswith("sqlite"):
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {
+        "pool_size": int(os.getenv("DB_POOL_SIZE", 5)),
+        "max_overflow": int(os.getenv("DB_MAX_OVERFLOW", 5)),
+        "pool_timeout": float(os.getenv("DB_POOL_TIMEOUT", 10)),
+        "pool_pre_ping": True,
+        "pool_recycle": 1800,
+    }
+
+# limits for POST /api/batch, see api/batch.py. With BATCH_MAX_WORKERS > 1 read-only
+# batches run on a thread pool whose threads hold their own connections, the pool grows by that much
+app.config['BATCH_MAX_REQUESTS'] = int(os.getenv("BATCH_MAX_REQUESTS", 20))
+app.config['BATCH_TIMEOUT'] = float(os.getenv("BATCH_TIMEOUT", 10.0))
+app.config['BATCH_MAX_WORKERS'] = int(os.getenv("BATCH_MAX_WORKERS", 1))
+if app.config['BATCH_MAX_WORKERS'] > 1 and 'SQLALCHEMY_ENGINE_OPTIONS' in app.config:
+    app.config['SQLALCHEMY_ENGINE_OPTIONS']['pool_size'] += app.config['BATCH_MAX_WORKERS']
+
 MIGRATE = Migrate(app, db, compare_type=True)
 db.init_app(app)
 
+# write-behind audit log, see api/audit.py
+app.config['AUDIT_FLUSH_INTERVAL'] = float(os.getenv("AUDIT_FLUSH_INTERVAL", 1.0))
+app.config['AUDIT_BUFFER_SIZE'] = int(os.getenv("AUDIT_BUFFER_SIZE", 10000))
+app.config['AUDIT_BATCH_SIZE'] = int(os.getenv("AUDIT_BATCH_SIZE", 500))
+setup_audit(app)
+
 # add the admin
 setup_admin(app)
 
 # add the admin
 setup_commands(app)
 
+# gzip/brotli for large responses, see api/compression.py
+app.config['COMPRESS_MIN_SIZE'] = int(os.getenv("COMPRESS_MIN_SIZE", 1024))
+setup_compression(app)
+
+# background jobs, run them with `flask worker`, see api/jobs.py
+app.config['JOB_RETRY_BASE'] = float(os.getenv("JOB_RETRY_BASE", 10))
+app.config['JOB_LOCK_TIMEOUT'] = float(os.getenv("JOB_LOCK_TIMEOUT", 3600))
+setup_jobs(app)
+
+# bearer tokens for the jobs endpoints, created with `flask create-token`
+# anyone who knows the key can sign tokens, so there is no default and short keys are refused:
+# without a key the endpoints that need a token answer 503
+jwt_secret_key = os.getenv("JWT_SECRET_KEY", "")
+if len(jwt_secret_key.encode()) >= 32:
+    app.config['JWT_SECRET_KEY'] = jwt_secret_key
+else:
+    app.config['JWT_SECRET_KEY'] = None
+    app.logger.warning("JWT_SECRET_KEY is missing or shorter than 32 bytes, token authentication is disabled")
+app.config['JWT_ACCESS_TOKEN_EXPIRES'] = timedelta(hours=float(os.getenv("JWT_EXPIRES_HOURS", 24)))
+JWTManager(app)
+
+# rate limits and concurrency caps for the api, see api/admission.py
+app.config['RATE_LIMIT_RATE'] = float(os.getenv("RATE_LIMIT_RATE", 10.0))
+app.config['RATE_LIMIT_BURST'] = float(os.getenv("RATE_LIMIT_BURST", 20.0))
+app.config['ADMISSION_LIMITS'] = os.getenv("ADMISSION_LIMITS", "gate=32,read=16,write=8,batch=4")
+app.config['ADMISSION_STORE'] = os.getenv("ADMISSION_STORE")
+# comma separated X-Api-Key values that get their own bucket, any other client is limited by its address
+app.config['API_KEYS'] = {key.strip() for key in os.getenv("API_KEYS", "").split(",") if key.strip()}
+setup_admission(app)
+
 # Add all endpoints form the API with a "api" prefix
 app.register_blueprint(api, url_prefix='/api')
 
@@ -0,0 +1,99 @@
+"""
+Gunicorn configuration, loaded by `gunicorn wsgi --chdir ./src/ -c src/gunicorn.conf.py`
+(-c is resolved from the launch directory, --chdir only applies after the config is read).
+
+Every value can be overridden with an environment variable:
+
+GUNICORN_WORKER_CLASS   gthread (default) or gevent, falls back to gthread when gevent is not installed
+WEB_CONCURRENCY         number of worker processes, defaults to 2 x CPUs + 1 (capped by GUNICORN_MAX_WORKERS)
+GUNICORN_THREADS        threads per gthread worker, default 4
+GUNICORN_CONNECTIONS    greenlets per gevent worker, default 100
+GUNICORN_MAX_REQUESTS   recycle a worker after this many requests (+ random jitter), default 1000
+GUNICORN_MAX_MEMORY_MB  recycle a worker after the request that takes its RSS over this size, default 512
+GUNICORN_TIMEOUT        seconds before a silent worker is killed, default 30
+GUNICORN_GRACEFUL_TIMEOUT seconds a worker gets to finish its requests on shutdown, default 30
+
+DB_POOL_SIZE defaults to a value derived from the concurrency of one worker
+(threads or greenlets) and ADMISSION_LIMITS to one derived from the database
+connections of that pool, an explicit value is kept.
+
+See docs/SERVING.md for the measured throughput of each mode.
+"""
+import multiprocessing
+import os
+
+bind = "0.0.0.0:" + os.getenv("PORT", "3001")
+
+
+def _gevent_available():
+    try:
+        import gevent  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+worker_class = os.getenv("GUNICORN_WORKER_CLASS", "gthread")
+if worker_class == "gevent" and not _gevent_available():
+    worker_class = "gthread"
+
+workers = int(os.getenv("WEB_CONCURRENCY", min(multiprocessing.cpu_count() * 2 + 1,
+                                               int(os.getenv("GUNICORN_MAX_WORKERS", 8)))))
+threads = int(os.getenv("GUNICORN_THREADS", 4))
+worker_connections = int(os.getenv("GUNICORN_CONNECTIONS", 100))
+
+# recycle workers regularly, the jitter keeps them from restarting all at once
+max_requests = int(os.getenv("GUNICORN_MAX_REQUESTS", 1000))
+max_requests_jitter = int(os.getenv("GUNICORN_MAX_REQUESTS_JITTER", max_requests // 10))
+max_memory_mb = int(os.getenv("GUNICORN_MAX_MEMORY_MB", 512))
+
+timeout = int(os.getenv("GUNICORN_TIMEOUT", 30))
+graceful_timeout = int(os.getenv("GUNICORN_GRACEFUL_TIMEOUT", 30))
+keepalive = 5
+
+# the pool size of each worker follows its concurrency, see SQLALCHEMY_ENGINE_OPTIONS in app.py
+os.environ.setdefault("DB_POOL_SIZE", str(worker_connections // 10 if worker_class == "gevent" else threads))
+
+# the concurrency caps of api/admission.py follow the connections a worker can open (pool +
+# overflow, see app.py), past them a request would wait on pool_timeout instead of getting a 503.
+# Gate checks and reads may use all of them (never more than the worker's threads or greenlets),
+# writes and batches only a share
+concurrency = worker_connections if worker_class == "gevent" else threads
+connections = min(concurrency, int(os.environ["DB_POOL_SIZE"]) + int(os.getenv("DB_MAX_OVERFLOW", 5)))
+ADMISSION_SHARES = {"gate": 1, "read": 1, "write": 1 / 2, "batch": 1 / 4}
+os.environ.setdefault("ADMISSION_LIMITS", ",".join(f"{name}={max(1, int(connections * share))}"
+                                                   for name, share in ADMISSION_SHARES.items()))
+
+accesslog = "-"
+
+
+def _rss_mb():
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 1024 / 1024
+    except (OSError, ValueError):
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def post_fork(server, worker):
+    if worker_class == "gevent":
+        # psycopg2 blocks the whole process unless it yields to the gevent hub
+        try:
+            from psycogreen.gevent import patch_psycopg
+            patch_psycopg()
+        except ImportError:
+            server.log.warning("psycogreen is not installed, database calls will block the gevent worker")
+
+
+def post_request(worker, req, environ, resp):
+    rss = _rss_mb()
+    if rss > max_memory_mb:
+        worker.log.warning("Worker %s uses %.0f MB (limit %s MB), recycling it", worker.pid, rss, max_memory_mb)
+        worker.alive = False
+
+
+def worker_exit(server, worker):
+    # drain the audit events still buffered in this worker before it exits
+    from api.audit import writer
+    writer.shutdown()
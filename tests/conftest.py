@@ -0,0 +1,44 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.realpath(__file__))), 'src'))
+
+pytest.importorskip('flask_sqlalchemy')
+
+
+@pytest.fixture(scope='session')
+def app(tmp_path_factory):
+    from api.querycheck import make_scratch_app
+    url = "sqlite:///" + str(tmp_path_factory.mktemp('db') / 'test.db')
+    return make_scratch_app(url)
+
+
+@pytest.fixture(scope='session')
+def db(app):
+    """The seeded scratch database (see querycheck.seed), shared by the whole session"""
+    from api.models import db
+    from api.querycheck import seed
+    with app.app_context():
+        db.create_all()
+        seed(db.session)
+        db.session.remove()
+    yield db
+    with app.app_context():
+        db.drop_all()
+
+
+@pytest.fixture
+def session(app, db):
+    # a fresh session per test, so nothing is served from a previous identity map
+    with app.app_context():
+        yield db.session
+        db.session.rollback()
+        db.session.remove()
+
+
+@pytest.fixture
+def client(app, session):
+    # requests get their own app context and session, the outer one gives assert_num_queries its engine
+    return app.test_client()
@@ -0,0 +1,99 @@
+"""
+Audit events of api/audit.py: changes are only written once their transaction
+commits, and access checks are recorded by the request hook
+"""
+import pytest
+from sqlalchemy import delete, select
+
+from api.audit import setup_audit, writer
+from api.models import db as _db, AuditEvent, Permit
+from api.querycheck import CHECK_TIME, make_scratch_app, make_token, seed
+
+
+@pytest.fixture(scope='module')
+def audit_app(tmp_path_factory):
+    # its own database, the permits of the shared one must not change under the query-count tests
+    app = make_scratch_app("sqlite:///" + str(tmp_path_factory.mktemp('audit') / 'audit.db'))
+    setup_audit(app)
+    with app.app_context():
+        _db.create_all()
+        seed(_db.session)
+        _db.session.remove()
+    yield app
+    writer.shutdown()
+    with app.app_context():
+        _db.drop_all()
+
+
+@pytest.fixture
+def session(audit_app):
+    writer.shutdown()
+    with audit_app.app_context():
+        _db.session.execute(delete(AuditEvent))
+        _db.session.commit()
+        yield _db.session
+        _db.session.rollback()
+        _db.session.remove()
+
+
+def written_events(session):
+    # stops the writer thread after draining the buffer, the next event starts it again
+    writer.shutdown()
+    session.expire_all()
+    return session.execute(
+        select(AuditEvent.entity_type, AuditEvent.entity_id, AuditEvent.action, AuditEvent.new_value)
+        .order_by(AuditEvent.id)).all()
+
+
+def set_status(session, permit_id, status):
+    session.get(Permit, permit_id).status = status
+    session.flush()
+
+
+def test_committed_change_is_written(session):
+    set_status(session, 1, 'cancelled')
+    session.commit()
+    assert written_events(session) == [('Permit', 1, 'status_change', 'cancelled')]
+
+
+def test_rolled_back_change_is_not_written(session):
+    set_status(session, 2, 'cancelled')
+    session.rollback()
+    session.commit()
+    assert written_events(session) == []
+
+
+def test_savepoint_rollback_keeps_the_outer_changes(session):
+    set_status(session, 3, 'cancelled')
+    savepoint = session.begin_nested()
+    set_status(session, 4, 'cancelled')
+    savepoint.rollback()
+    session.commit()
+    assert written_events(session) == [('Permit', 3, 'status_change', 'cancelled')]
+
+
+def test_released_savepoint_is_written(session):
+    with session.begin_nested():
+        set_status(session, 5, 'cancelled')
+    session.commit()
+    assert written_events(session) == [('Permit', 5, 'status_change', 'cancelled')]
+
+
+def test_access_check_is_recorded_without_query_string(audit_app, session):
+    client = audit_app.test_client()
+    at = CHECK_TIME.isoformat()
+    # person 6 holds permit 6, for station 1, which the other tests leave alone
+    assert client.get(f'/api/access?national_id=0000006&station_id=1&at={at}').status_code == 200
+    assert client.get(f'/api/access?national_id=0000006&station_id=2&at={at}').status_code == 403
+    assert written_events(session) == [('PersonalInfo', 6, 'access_check', 'allowed'),
+                                       ('PersonalInfo', 6, 'access_check', 'denied')]
+    assert set(session.scalars(select(AuditEvent.path))) == {'/api/access'}
+
+
+def test_audit_log_needs_an_audit_token(audit_app, session):
+    client = audit_app.test_client()
+    assert client.get('/api/audit').status_code == 401
+    headers = {'Authorization': 'Bearer ' + make_token(audit_app, job_kinds=[])}
+    assert client.get('/api/audit', headers=headers).status_code == 403
+    headers = {'Authorization': 'Bearer ' + make_token(audit_app, audit=True)}
+    assert client.get('/api/audit', headers=headers).status_code == 200
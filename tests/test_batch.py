@@ -0,0 +1,92 @@
+"""
+POST /api/batch (api/batch.py): the serial path on the batch's own session, the
+thread pool for read-only batches, and the timeout with its admission slot
+"""
+import threading
+import time
+
+import pytest
+from flask import jsonify
+
+from api.admission import setup_admission
+from api.querycheck import make_scratch_app
+
+
+def probe_view(calls, release=None):
+    """Replacement for /api/hello reporting the thread that served it"""
+    def view():
+        calls.append(threading.get_ident())
+        if release is not None:
+            release.wait(5)
+        return jsonify(thread=threading.get_ident())
+    return view
+
+
+def test_serial_batch(app, client, monkeypatch):
+    calls = []
+    monkeypatch.setitem(app.view_functions, 'api.handle_hello', probe_view(calls))
+    response = client.post('/api/batch', json={"requests": [
+        {"path": "/api/hello"},
+        {"path": "/api/permits?limit=2"},
+        {"path": "/api/nope"},
+        {"path": "/api/hello", "method": "POST"},
+    ]})
+    assert response.status_code == 200
+    results = response.json['responses']
+    assert [r['status'] for r in results] == [200, 200, 404, 200]
+    assert len(results[1]['body']) == 2
+    # in order, on the thread (and so the session) of the batch request
+    assert results[0]['body'] == results[3]['body']
+    assert results[0]['body']['thread'] == threading.get_ident()
+
+
+def test_invalid_batch(client):
+    assert client.post('/api/batch', json={"requests": []}).status_code == 400
+    response = client.post('/api/batch', json={"requests": [{"path": "/api/batch"}, {"nope": 1}]})
+    assert response.status_code == 400
+    assert set(response.json['errors']) == {'0', '1'}
+
+
+def test_read_batch_on_the_thread_pool(app, client, monkeypatch):
+    calls = []
+    monkeypatch.setitem(app.view_functions, 'api.handle_hello', probe_view(calls))
+    monkeypatch.setitem(app.config, 'BATCH_MAX_WORKERS', 2)
+    results = client.post('/api/batch', json={"requests": [{"path": "/api/hello"}] * 4}).json['responses']
+    assert [r['status'] for r in results] == [200] * 4
+    assert threading.get_ident() not in calls
+
+    # a write anywhere in the batch keeps it serial
+    results = client.post('/api/batch', json={"requests": [{"path": "/api/hello"},
+                                                           {"path": "/api/hello", "method": "POST"}]}).json
+    assert {r['body']['thread'] for r in results['responses']} == {threading.get_ident()}
+
+
+@pytest.fixture
+def admitted_app(tmp_path):
+    app = make_scratch_app("sqlite:///" + str(tmp_path / 'batch.db'))
+    app.config.update(RATE_LIMIT_RATE=1000, RATE_LIMIT_BURST=1000, ADMISSION_LIMITS="batch=1",
+                      BATCH_MAX_WORKERS=2, BATCH_TIMEOUT=0.2)
+    setup_admission(app)
+    return app
+
+
+def test_timed_out_batch_keeps_its_slot_until_the_sub_requests_end(admitted_app, monkeypatch):
+    calls = []
+    release = threading.Event()
+    monkeypatch.setitem(admitted_app.view_functions, 'api.handle_hello', probe_view(calls, release))
+    client = admitted_app.test_client()
+    batch = {"requests": [{"path": "/api/hello"}] * 6}
+
+    response = client.post('/api/batch', json=batch)
+    assert [r['status'] for r in response.json['responses']] == [504] * 6
+    # two sub-requests are still running, the only batch slot is still taken
+    assert client.post('/api/batch', json=batch).status_code == 503
+
+    release.set()
+    deadline = time.monotonic() + 5
+    while admitted_app.extensions['admission'].slots['batch']._value == 0 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    # the queued sub-requests were cancelled instead of running after the deadline
+    assert len(calls) == 2
+    monkeypatch.setitem(admitted_app.config, 'BATCH_TIMEOUT', 5)
+    assert client.post('/api/batch', json=batch).status_code == 200
@@ -0,0 +1,82 @@
+"""
+The job queue of api/jobs.py: claiming on sqlite and the token checks of /api/jobs
+"""
+from datetime import datetime
+
+import jwt
+import pytest
+from sqlalchemy import delete, update
+from sqlalchemy.sql import Update
+
+import api.tasks  # noqa: F401, registers the handlers like setup_jobs
+from api.jobs import claim
+from api.models import Job
+from api.querycheck import make_token
+
+
+@pytest.fixture
+def jobs(session):
+    yield
+    session.rollback()
+    session.execute(delete(Job))
+    session.commit()
+
+
+def bearer(token):
+    return {'Authorization': 'Bearer ' + token}
+
+
+def test_claim_retries_when_another_worker_wins(app, session, jobs, monkeypatch):
+    due = datetime(2026, 1, 1)
+    session.add_all([Job(kind='permits.report', status='queued', progress=0, attempts=0, max_attempts=3,
+                         run_at=due, created_at=due)
+                     for _ in range(2)])
+    session.commit()
+    first, second = sorted(job.id for job in session.query(Job))
+    execute = session.execute
+
+    def racing_execute(statement, *args, **kwargs):
+        if isinstance(statement, Update) and not racing_execute.raced:
+            # another worker claims the same job between our select and our update
+            racing_execute.raced = True
+            with app.extensions['sqlalchemy'].engine.begin() as conn:
+                conn.execute(update(Job).where(Job.id == first).values(status='running', locked_by='other'))
+        return execute(statement, *args, **kwargs)
+    racing_execute.raced = False
+    monkeypatch.setattr(session, 'execute', racing_execute)
+
+    job = claim('me')
+    assert job is not None and job.id == second and job.locked_by == 'me'
+
+
+def test_jobs_need_a_token(client, jobs):
+    assert client.get('/api/jobs').status_code == 401
+    assert client.post('/api/jobs', json={'kind': 'permits.report'}).status_code == 401
+
+
+@pytest.mark.filterwarnings('ignore:The HMAC key')
+def test_forged_token_is_refused(client, jobs):
+    # signed with the FLASK_APP_KEY committed in render.yaml, which used to be the fallback secret
+    forged = jwt.encode({'sub': '1', 'type': 'access', 'fresh': False, 'job_kinds': ['personal_info.import']},
+                        'any key works', algorithm='HS256')
+    response = client.post('/api/jobs', json={'kind': 'personal_info.import'}, headers=bearer(forged))
+    assert response.status_code in (401, 422)
+
+
+def test_token_limits_kinds_and_visibility(app, client, jobs):
+    owner = bearer(make_token(app, identity=1, job_kinds=['permits.report']))
+    other = bearer(make_token(app, identity=2, job_kinds=['permits.report']))
+    assert client.post('/api/jobs', json={'kind': 'personal_info.import'}, headers=owner).status_code == 403
+    created = client.post('/api/jobs', json={'kind': 'permits.report'}, headers=owner)
+    assert created.status_code == 202
+    job_id = created.json['id']
+    assert client.get(f'/api/jobs/{job_id}', headers=owner).status_code == 200
+    assert client.get(f'/api/jobs/{job_id}', headers=other).status_code == 404
+    assert client.get('/api/jobs', headers=other).json == []
+
+
+def test_no_secret_key_disables_the_token_endpoints(app, client, jobs, monkeypatch):
+    token = make_token(app, job_kinds=['permits.report'], audit=True)
+    monkeypatch.setitem(app.config, 'JWT_SECRET_KEY', None)
+    assert client.post('/api/jobs', json={'kind': 'permits.report'}, headers=bearer(token)).status_code == 503
+    assert client.get('/api/audit', headers=bearer(token)).status_code == 503
@@ -0,0 +1,65 @@
+"""
+Number of statements sent by the endpoints and the serializers, see api/querycheck.py.
+A failure here usually means a relationship is loaded lazily again (N+1)
+"""
+from datetime import timedelta
+
+from api.models import Permit
+from api.querycheck import CHECK_TIME, SEED_PERMITS, assert_num_queries, compare, load_budgets, run_checks
+from api.queries import list_permits
+
+
+def test_permit_serialize_lazy(session):
+    permit = session.get(Permit, 1)
+    # stations and people, one query each
+    with assert_num_queries(2):
+        permit.serialize()
+
+
+def test_permit_serialize_preloaded(session):
+    permits = list_permits(session)
+    with assert_num_queries(0):
+        [p.serialize() for p in permits]
+
+
+def test_permit_listing_does_not_grow_with_the_page(client):
+    with assert_num_queries(3):
+        response = client.get('/api/permits?limit=5')
+    assert len(response.json) == 5
+    with assert_num_queries(3):
+        response = client.get('/api/permits?limit=500')
+    assert len(response.json) == SEED_PERMITS
+
+
+def test_permit_listing_pages(client):
+    first = client.get('/api/permits?limit=5').json
+    second = client.get(f"/api/permits?limit=5&after_id={first[-1]['id']}").json
+    assert [p['id'] for p in second] == list(range(6, 11))
+
+
+def test_access_check(client):
+    at = CHECK_TIME.isoformat()
+    # person 1 holds a permit for station 2 only
+    with assert_num_queries(2):
+        allowed = client.get(f'/api/access?national_id=0000001&station_id=2&at={at}')
+    assert allowed.status_code == 200
+    with assert_num_queries(2):
+        denied = client.get(f'/api/access?national_id=0000001&station_id=1&at={at}')
+    assert denied.status_code == 403
+    with assert_num_queries(1):
+        unknown = client.get(f'/api/access?national_id=9999999&station_id=1&at={at}')
+    assert unknown.status_code == 403
+
+
+def test_station_overlaps(client):
+    start, end = CHECK_TIME.isoformat(), (CHECK_TIME + timedelta(days=1)).isoformat()
+    with assert_num_queries(3):
+        response = client.get(f'/api/stations/1/permits?start={start}&end={end}')
+    assert response.status_code == 200
+    assert response.json and all(p['stations'] == ['Station 1'] for p in response.json)
+
+
+def test_budgets_are_up_to_date(tmp_path):
+    # the same check as `flask check-queries`, on its own scratch database
+    report = run_checks("sqlite:///" + str(tmp_path / 'querycheck.db'))
+    assert compare(report, load_budgets().get('sqlite', {})) == []